@@ -1,107 +1,30 @@
+import logging
+import sqlite3
 from typing import Any, Text, Dict, List
 from rasa_sdk import Action, Tracker
 from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.events import SlotSet, AllSlotsReset, ActiveLoop
 from rasa_sdk.forms import FormValidationAction
 
-# Authorized supplier list from CROaccess.com
-AUTHORIZED_SUPPLIERS = [
-    'Pylon Phenomics',
-    'CROquest',
-    'Novotech',
-    'Allucent',
-    'BioAgile',
-    'Clario',
-    'Fortrea',
-    'Icon',
-    'Parexel',
-    'Thermo Fisher Scientific (PPD)',
-    'Syneos Health',
-    'Medpace',
-    'Labcorp Drug Development',
-    'Advanced Clinical',
-    'Worldwide Clinical Trials'
-]
+from actions.match_cache import MATCH_CACHE
+from actions.matching import discard_partial_scores, match_suppliers_async, update_partial_scores
+from actions.metrics import GAUGE_SOURCES, instrument
+from actions.outbox import DELIVERED, OUTBOX, idempotency_key, start_delivery, start_delivery_with_server
+from actions.reports import Scope, render
+from actions.vocabulary import CLARIFY, VALIDATION, resolve, resolve_timeline
 
-# Supplier specializations and expertise
-SUPPLIER_EXPERTISE = {
-    'Pylon Phenomics': {
-        'specialties': ['bioanalytical', 'single-cell analysis', 'spatial biology', 'assay development'],
-        'therapeutic_areas': ['oncology', 'immunology', 'neuroscience'],
-        'services': ['bioanalytical services', 'data management', 'assay development']
-    },
-    'CROquest': {
-        'specialties': ['clinical trials', 'regulatory affairs', 'data management'],
-        'therapeutic_areas': ['oncology', 'cardiology', 'neurology', 'immunology'],
-        'services': ['clinical trial management', 'regulatory support', 'data management']
-    },
-    'Novotech': {
-        'specialties': ['clinical trials', 'patient recruitment', 'site management'],
-        'therapeutic_areas': ['oncology', 'cardiology', 'diabetes', 'respiratory'],
-        'services': ['clinical trial management', 'patient recruitment', 'site management']
-    },
-    'Allucent': {
-        'specialties': ['clinical development', 'regulatory affairs', 'biostatistics'],
-        'therapeutic_areas': ['oncology', 'rare diseases', 'neurology'],
-        'services': ['clinical trial management', 'regulatory support', 'biostatistics']
-    },
-    'BioAgile': {
-        'specialties': ['preclinical', 'toxicology', 'assay development'],
-        'therapeutic_areas': ['oncology', 'immunology', 'infectious diseases'],
-        'services': ['preclinical research', 'toxicology studies', 'assay development']
-    },
-    'Clario': {
-        'specialties': ['clinical trial technology', 'data management', 'eCOA'],
-        'therapeutic_areas': ['oncology', 'cardiology', 'neurology', 'respiratory'],
-        'services': ['clinical trial management', 'data management', 'patient reported outcomes']
-    },
-    'Fortrea': {
-        'specialties': ['clinical trials', 'regulatory affairs', 'patient recruitment'],
-        'therapeutic_areas': ['oncology', 'cardiology', 'diabetes', 'rare diseases'],
-        'services': ['clinical trial management', 'regulatory support', 'patient recruitment']
-    },
-    'Icon': {
-        'specialties': ['clinical trials', 'biostatistics', 'medical writing'],
-        'therapeutic_areas': ['oncology', 'cardiology', 'neurology', 'immunology'],
-        'services': ['clinical trial management', 'biostatistics', 'medical writing']
-    },
-    'Parexel': {
-        'specialties': ['clinical trials', 'regulatory affairs', 'patient recruitment'],
-        'therapeutic_areas': ['oncology', 'cardiology', 'neurology', 'rare diseases'],
-        'services': ['clinical trial management', 'regulatory support', 'patient recruitment']
-    },
-    'Thermo Fisher Scientific (PPD)': {
-        'specialties': ['clinical trials', 'laboratory services', 'bioanalytical'],
-        'therapeutic_areas': ['oncology', 'cardiology', 'immunology', 'infectious diseases'],
-        'services': ['clinical trial management', 'laboratory services', 'bioanalytical services']
-    },
-    'Syneos Health': {
-        'specialties': ['clinical trials', 'commercialization', 'patient recruitment'],
-        'therapeutic_areas': ['oncology', 'cardiology', 'neurology', 'respiratory'],
-        'services': ['clinical trial management', 'patient recruitment', 'commercialization']
-    },
-    'Medpace': {
-        'specialties': ['clinical trials', 'regulatory affairs', 'medical writing'],
-        'therapeutic_areas': ['oncology', 'cardiology', 'neurology', 'rare diseases'],
-        'services': ['clinical trial management', 'regulatory support', 'medical writing']
-    },
-    'Labcorp Drug Development': {
-        'specialties': ['clinical trials', 'laboratory services', 'bioanalytical'],
-        'therapeutic_areas': ['oncology', 'cardiology', 'immunology', 'infectious diseases'],
-        'services': ['clinical trial management', 'laboratory services', 'bioanalytical services']
-    },
-    'Advanced Clinical': {
-        'specialties': ['clinical trials', 'regulatory affairs', 'patient recruitment'],
-        'therapeutic_areas': ['oncology', 'cardiology', 'neurology', 'immunology'],
-        'services': ['clinical trial management', 'regulatory support', 'patient recruitment']
-    },
-    'Worldwide Clinical Trials': {
-        'specialties': ['clinical trials', 'patient recruitment', 'site management'],
-        'therapeutic_areas': ['oncology', 'cardiology', 'neurology', 'respiratory'],
-        'services': ['clinical trial management', 'patient recruitment', 'site management']
-    }
-}
+logger = logging.getLogger(__name__)
 
+# Export cache and outbox statistics alongside the action metrics
+if MATCH_CACHE is not None:
+    GAUGE_SOURCES.append(lambda: {f"cro_match_cache_{name}": value for name, value in MATCH_CACHE.stats().items()})
+GAUGE_SOURCES.append(lambda: {f"cro_outbox_{name}": value for name, value in OUTBOX.stats().items()})
+GAUGE_SOURCES.append(lambda: {f"cro_report_cache_{name}": value for name, value in render.cache_info()._asdict().items()})
+
+# Deliver projects left in the outbox by a restart as soon as the action server is up
+start_delivery_with_server()
+
+@instrument
 class ActionStartProjectScoping(Action):
     def name(self) -> Text:
         return "action_start_project_scoping"
@@ -110,6 +33,7 @@ class ActionStartProjectScoping(Action):
         dispatcher.utter_message(text="Great! Let's start building your project scope. What phase of study are you planning? (e.g., Phase I, Phase II, Phase III, Phase IV, Preclinical)")
         return []
 
+@instrument
 class ActionStartProjectScopingFallback(Action):
     def name(self) -> Text:
         return "action_start_project_scoping_fallback"
@@ -118,179 +42,71 @@ class ActionStartProjectScopingFallback(Action):
         dispatcher.utter_message(text="I don't get what you are asking, you want help for your project or do you want to find CRO?")
         return []
 
+@instrument
 class ActionOutputProjectScope(Action):
     def name(self) -> Text:
         return "action_output_project_scope"
 
     def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        study_phase = tracker.get_slot("study_phase")
-        therapeutic_area = tracker.get_slot("therapeutic_area")
-        services_needed = tracker.get_slot("services_needed")
-        patient_population = tracker.get_slot("patient_population")
-        timeline = tracker.get_slot("timeline")
+        scope = Scope.from_tracker(tracker)
 
         # Project Scope
-        msg = "Project Scope:\n"
-        if study_phase:
-            msg += f"• Study Phase: {study_phase}\n"
-        if therapeutic_area:
-            msg += f"• Therapeutic Area: {therapeutic_area}\n"
-        if services_needed:
-            msg += f"• Services Needed: {', '.join(services_needed)}\n"
-        if patient_population:
-            msg += f"• Patient Population: {patient_population}\n"
-        if timeline:
-            msg += f"• Timeline: {timeline}\n"
-
-        if msg.strip() == "Project Scope:":
-            msg = "Project information is not available."
-
-        dispatcher.utter_message(text=msg)
+        dispatcher.utter_message(text=render(scope, 'scope'))
 
         # Brief Project Report
-        report = "Project Report:\n"
-        summary_lines = []
-        if study_phase and therapeutic_area:
-            summary_lines.append(f"This project is designed as a {study_phase} clinical study in the therapeutic area of {therapeutic_area}.")
-        elif study_phase:
-            summary_lines.append(f"This project is designed as a {study_phase} clinical study.")
-        elif therapeutic_area:
-            summary_lines.append(f"This project focuses on the therapeutic area of {therapeutic_area}.")
-        if patient_population:
-            summary_lines.append(f"The target patient population consists of {patient_population}.")
-        if services_needed:
-            summary_lines.append(f"Key services required for this project include: {', '.join(services_needed)}.")
-        if timeline:
-            summary_lines.append(f"The anticipated project duration is {timeline}.")
-        if summary_lines:
-            report += "\n".join(summary_lines)
-        else:
-            report += "Project details are incomplete."
-
-        dispatcher.utter_message(text=report)
+        dispatcher.utter_message(text=render(scope, 'report'))
         return [SlotSet("project_scope_complete", True)]
 
+@instrument
 class ActionMatchCROs(Action):
     def name(self) -> Text:
         return "action_match_cros"
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         study_phase = tracker.get_slot("study_phase")
         therapeutic_area = tracker.get_slot("therapeutic_area")
         services_needed = tracker.get_slot("services_needed")
         patient_population = tracker.get_slot("patient_population")
-        timeline = tracker.get_slot("timeline")
-        
-        # Score suppliers based on project requirements
-        supplier_scores = []
-        
-        for supplier in AUTHORIZED_SUPPLIERS:
-            score = 80  # Base score
-            expertise = SUPPLIER_EXPERTISE.get(supplier, {})
-            
-            # Score based on therapeutic area match
-            if therapeutic_area and therapeutic_area.lower() in [area.lower() for area in expertise.get('therapeutic_areas', [])]:
-                score += 10
-            
-            # Score based on services match
-            if services_needed:
-                for service in services_needed:
-                    if service.lower() in [s.lower() for s in expertise.get('services', [])]:
-                        score += 5
-            
-            # Score based on study phase expertise
-            if study_phase:
-                if study_phase.lower() in ['phase i', 'phase 1', 'preclinical'] and 'preclinical' in expertise.get('specialties', []):
-                    score += 5
-                elif study_phase.lower() in ['phase ii', 'phase 2', 'phase iii', 'phase 3', 'phase iv', 'phase 4'] and 'clinical trials' in expertise.get('specialties', []):
-                    score += 5
-            
-            # Score based on patient population expertise
-            if patient_population:
-                if patient_population.lower() in ['pediatric', 'children'] and 'pediatric' in expertise.get('specialties', []):
-                    score += 3
-                elif patient_population.lower() in ['elderly', 'seniors'] and 'geriatric' in expertise.get('specialties', []):
-                    score += 3
-            
-            score = min(score, 100)
-            
-            if score >= 80:
-                supplier_scores.append({
-                    'name': supplier,
-                    'score': score,
-                    'reason': self._generate_reason(
-                        supplier,
-                        expertise,
-                        study_phase or "",
-                        therapeutic_area or "",
-                        services_needed or []
-                    )
-                })
-        
-        # Sort by score and take top 5
-        supplier_scores.sort(key=lambda x: x['score'], reverse=True)
-        top_suppliers = supplier_scores[:5]
-        
+
+        top_suppliers = await match_suppliers_async(study_phase, therapeutic_area, services_needed, patient_population, sender_id=tracker.sender_id)
+
         # Format response
         msg = "Based on your project requirements, here are the top CRO matches:\n\n"
         for supplier in top_suppliers:
             msg += f"{supplier['name']} (Score: {supplier['score']})\n"
             msg += f"Reason: {supplier['reason']}\n\n"
-        
+
         msg += "Please type the name of the CRO you'd like to select."
         dispatcher.utter_message(text=msg)
         return []
 
-    def _generate_reason(self, supplier: str, expertise: Dict, study_phase: str, therapeutic_area: str, services_needed: List[str]) -> str:
-        reasons = []
-        
-        if therapeutic_area and therapeutic_area.lower() in [area.lower() for area in expertise.get('therapeutic_areas', [])]:
-            reasons.append(f"expertise in {therapeutic_area}")
-        
-        if services_needed:
-            matched_services = []
-            for service in services_needed:
-                if service.lower() in [s.lower() for s in expertise.get('services', [])]:
-                    matched_services.append(service)
-            if matched_services:
-                reasons.append(f"specializes in {', '.join(matched_services)}")
-        
-        if study_phase:
-            if study_phase.lower() in ['phase i', 'phase 1', 'preclinical'] and 'preclinical' in expertise.get('specialties', []):
-                reasons.append("strong preclinical capabilities")
-            elif study_phase.lower() in ['phase ii', 'phase 2', 'phase iii', 'phase 3', 'phase iv', 'phase 4'] and 'clinical trials' in expertise.get('specialties', []):
-                reasons.append("extensive clinical trial experience")
-        
-        if reasons:
-            return f"{supplier} has {', '.join(reasons)}."
-        else:
-            return f"{supplier} offers comprehensive CRO services suitable for your project."
-
+@instrument
 class ActionSendProject(Action):
     def name(self) -> Text:
         return "action_send_project"
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        cro_name = tracker.get_slot("cro_name")
-        study_phase = tracker.get_slot("study_phase")
-        therapeutic_area = tracker.get_slot("therapeutic_area")
-        services_needed = tracker.get_slot("services_needed")
-        patient_population = tracker.get_slot("patient_population")
-        timeline = tracker.get_slot("timeline")
-        
-        msg = (
-            f"Perfect! Your project details have been sent to {cro_name}!\n\n"
-            f"Project Summary:\n"
-            f"• Study Phase: {study_phase}\n"
-            f"• Therapeutic Area: {therapeutic_area}\n"
-            f"• Services Needed: {', '.join(services_needed) if services_needed else 'Not specified'}\n"
-            f"• Patient Population: {patient_population}\n"
-            f"• Timeline: {timeline}\n\n"
-            f"{cro_name} will contact you within 24-48 hours to discuss your project in detail."
-        )
-        dispatcher.utter_message(text=msg)
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        scope = Scope.from_tracker(tracker)
+
+        # Queue the handoff and let the delivery worker send it in the background
+        slots = scope._asdict()
+        cro_name = slots.pop("cro_name")
+        try:
+            status = OUTBOX.enqueue(
+                {"cro_name": cro_name, "sender_id": tracker.sender_id, "scope": slots},
+                idempotency_key(tracker.sender_id, cro_name, slots)
+            )
+        except sqlite3.Error:
+            logger.exception(f"Could not queue the project of {tracker.sender_id} for {cro_name}")
+            dispatcher.utter_message(text=f"Sorry, your project details could not be sent to {cro_name}. Please try again in a moment.")
+            return []
+        start_delivery()
+
+        # A scope delivered recently is not sent twice; anything else is now waiting for delivery
+        dispatcher.utter_message(text=render(scope, 'already_sent' if status == DELIVERED else 'handoff'))
         return []
 
+@instrument
 class ValidateProjectScopeForm(FormValidationAction):
     def name(self) -> Text:
         return "validate_project_scope_form"
@@ -303,118 +119,73 @@ class ValidateProjectScopeForm(FormValidationAction):
         latest_intent = tracker.latest_message.get("intent", {}).get("name")
         if latest_intent == "start_project_scoping":
             dispatcher.utter_message(text="Understood, let's start a new project scope. What phase of study are you planning? (e.g., Phase I, Phase II, Phase III, Phase IV, Preclinical)")
+            discard_partial_scores(tracker.sender_id)
             events = [AllSlotsReset(), ActiveLoop("project_scope_form")]
             return events
         # Otherwise, use default validation
         return super().validate(dispatcher, tracker, domain)
 
-    def validate_study_phase(self, value: Text, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> Dict[Text, Any]:
+    def _accept(self, slot: Text, value: Any, tracker: Tracker) -> Dict[Text, Any]:
+        # Keep the conversation's match scores current, so action_match_cros has them ready
+        update_partial_scores(tracker.sender_id, slot, value)
+        return {slot: value}
+
+    def _validate_choice(self, slot: Text, value: Text, dispatcher: CollectingDispatcher, tracker: Tracker) -> Dict[Text, Any]:
         requested = tracker.get_slot("requested_slot")
-        if requested != "study_phase":
-            return {"study_phase": tracker.get_slot("study_phase")}
-        valid_phases = [
-            "phase i", "phase 1", "phase ii", "phase 2", "phase iii", "phase 3", "phase iv", "phase 4", "preclinical"
-        ]
-        if value.strip().lower() in valid_phases:
-            return {"study_phase": value.strip()}
-        bullets = "\n".join([
-            "• Phase I",
-            "• Phase II",
-            "• Phase III",
-            "• Phase IV",
-            "• Preclinical"
-        ])
-        dispatcher.utter_message(text=f"I don't understand what you are saying. Please clarify. Here are the valid study phases you can choose from:\n{bullets}")
-        return {"study_phase": None}
+        if requested != slot:
+            return {slot: tracker.get_slot(slot)}
+        if VALIDATION.accepts(slot, value):
+            return self._accept(slot, value.strip(), tracker)
+        # Map typos and synonyms to the canonical value instead of asking again
+        resolved = resolve(slot, value)
+        if resolved:
+            return self._accept(slot, resolved, tracker)
+        dispatcher.utter_message(text=VALIDATION.slots[slot].reject_message)
+        return {slot: None}
+
+    def validate_study_phase(self, value: Text, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> Dict[Text, Any]:
+        return self._validate_choice("study_phase", value, dispatcher, tracker)
 
     def validate_therapeutic_area(self, value: Text, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> Dict[Text, Any]:
-        requested = tracker.get_slot("requested_slot")
-        if requested != "therapeutic_area":
-            return {"therapeutic_area": tracker.get_slot("therapeutic_area")}
-        valid_areas = [
-            "oncology", "cardiology", "neurology", "immunology", "diabetes", "rheumatology", "dermatology", "respiratory", "gastroenterology"
-        ]
-        if value.strip().lower() in valid_areas:
-            return {"therapeutic_area": value.strip()}
-        bullets = "\n".join([
-            "• Oncology",
-            "• Cardiology",
-            "• Neurology",
-            "• Immunology",
-            "• Diabetes",
-            "• Rheumatology",
-            "• Dermatology",
-            "• Respiratory",
-            "• Gastroenterology"
-        ])
-        dispatcher.utter_message(text=f"I don't understand what you are saying. Please clarify. Here are the valid therapeutic areas you can choose from:\n{bullets}")
-        return {"therapeutic_area": None}
+        return self._validate_choice("therapeutic_area", value, dispatcher, tracker)
 
     def validate_services_needed(self, value: Any, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> Dict[Text, Any]:
         requested = tracker.get_slot("requested_slot")
         if requested != "services_needed":
             return {"services_needed": tracker.get_slot("services_needed")}
-        valid_services = [
-            "clinical trial management", "data management", "regulatory support", "patient recruitment", "site management", "biostatistics", "medical writing", "safety monitoring", "quality assurance", "preclinical research", "toxicology studies", "assay development", "laboratory services", "bioanalytical services", "patient reported outcomes", "commercialization", "spatial biology", "single-cell analysis", "protein production", "prototyping", "scientific writing", "clinical development", "ecoa", "laboratory skills", "biophysical assays and screening", "spatial imaging analysis", "large molecule bioanalysis", "comprehensive pathology solutions", "clinical diagnostics"
-        ]
+        services = VALIDATION.slots["services_needed"]
         if isinstance(value, list):
-            cleaned = [v.strip().lower() for v in value]
-            invalid = [v for v in cleaned if v not in valid_services]
-            if not invalid and cleaned:
-                return {"services_needed": value}
+            invalid = [v for v in value if v.strip().lower() not in services.accepted]
+            if not invalid and value:
+                return self._accept("services_needed", value, tracker)
             if invalid:
-                bullets = "\n".join([f"• {s.title()}" for s in valid_services])
-                dispatcher.utter_message(text=f"I don't understand what you are saying. Please clarify. Here are the valid services you can choose from:\n{bullets}")
+                resolved = {v: resolve("services_needed", v) for v in invalid}
+                if all(resolved.values()):
+                    return self._accept("services_needed", [resolved.get(v, v) for v in value], tracker)
+                dispatcher.utter_message(text=services.reject_message)
                 return {"services_needed": None}
         elif isinstance(value, str):
-            if value.strip().lower() in valid_services:
-                return {"services_needed": [value.strip()]}
-            bullets = "\n".join([f"• {s.title()}" for s in valid_services])
-            dispatcher.utter_message(text=f"I don't understand what you are saying. Please clarify. Here are the valid services you can choose from:\n{bullets}")
+            if value.strip().lower() in services.accepted:
+                return self._accept("services_needed", [value.strip()], tracker)
+            resolved = resolve("services_needed", value)
+            if resolved:
+                return self._accept("services_needed", [resolved], tracker)
+            dispatcher.utter_message(text=services.reject_message)
             return {"services_needed": None}
-        dispatcher.utter_message(text=f"I don't understand what you are saying. Please clarify. Here are the valid services you can choose from:")
+        dispatcher.utter_message(text=f"{CLARIFY} Here are the valid services you can choose from:")
         return {"services_needed": None}
 
     def validate_patient_population(self, value: Text, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> Dict[Text, Any]:
-        requested = tracker.get_slot("requested_slot")
-        if requested != "patient_population":
-            return {"patient_population": tracker.get_slot("patient_population")}
-        valid_populations = [
-            "adults", "pediatric", "elderly"
-        ]
-        if value.strip().lower() in valid_populations:
-            return {"patient_population": value.strip()}
-        bullets = "\n".join([
-            "• Adults",
-            "• Pediatric",
-            "• Elderly"
-        ])
-        dispatcher.utter_message(text=f"I don't understand what you are saying. Please clarify. Here are the valid patient populations you can choose from:\n{bullets}")
-        return {"patient_population": None}
+        return self._validate_choice("patient_population", value, dispatcher, tracker)
 
     def validate_timeline(self, value: Text, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> Dict[Text, Any]:
         requested = tracker.get_slot("requested_slot")
         if requested != "timeline":
             return {"timeline": tracker.get_slot("timeline")}
-        import re
-        pattern = r"^(\d+\s*(months?|weeks?|years?|days?))$"
-        if re.match(pattern, value.strip().lower()):
+        if VALIDATION.timeline.pattern.match(value.strip().lower()):
             return {"timeline": value.strip()}
-        examples = "\n".join([
-            "• 6 months",
-            "• 12 months",
-            "• 18 months",
-            "• 24 months",
-            "• 1 year",
-            "• 2 years",
-            "• 3 years",
-            "• 6 weeks",
-            "• 12 weeks",
-            "• 18 weeks",
-            "• 24 weeks",
-            "• 1 month",
-            "• 2 months",
-            "• 3 months"
-        ])
-        dispatcher.utter_message(text=f"I don't understand what you are saying. Please clarify. Please provide the timeline in a format like one of these examples:\n{examples}")
+        resolved = resolve_timeline(value)
+        if resolved:
+            return {"timeline": resolved}
+        dispatcher.utter_message(text=VALIDATION.timeline.reject_message)
         return {"timeline": None}
@@ -0,0 +1,158 @@
+"""Offline batch matching of many project scopes against the supplier catalog.
+
+Scores every scope x supplier pair in one vectorized step with the scoring rules of
+``ActionMatchCROs`` (see ``actions.scoring``) and writes the top matches per scope. Input and output are
+JSONL streams, one scope per line::
+
+    python -m actions.batch_match scopes.jsonl matches.jsonl --top-k 5
+
+Each input line holds the scope slots (``study_phase``, ``therapeutic_area``,
+``services_needed``, ``patient_population``) and an optional ``id``.
+NumPy is imported lazily because the action server imports every module in
+this package at startup.
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, Iterable, Iterator, List, Text, TextIO
+
+from actions.matching import TOP_MATCHES, match_suppliers, render_matches
+from actions.catalog import FIELDS, get_catalog
+from actions.scoring import Scorer, get_scorer
+
+CHUNK_SIZE = 1024
+
+
+class SupplierMatrix:
+    """Supplier expertise encoded as 0/1 feature matrices (suppliers x vocabulary)."""
+
+    def __init__(self, scorer: Scorer) -> None:
+        import numpy as np
+
+        catalog = scorer.catalog
+        self.scorer = scorer
+        self.suppliers = catalog.suppliers
+        self.vocab = {field: {token: i for i, token in enumerate(catalog.index[field])} for field in FIELDS}
+
+        self.features = {}
+        for field, tokens in self.vocab.items():
+            matrix = np.zeros((len(self.suppliers), len(tokens)), dtype=np.int32)
+            for token, supplier_ids in catalog.index[field].items():
+                matrix[list(supplier_ids), tokens[token]] = 1
+            self.features[field] = matrix
+
+    def encode_scopes(self, scopes: List[Dict[Text, Any]]) -> Dict[Text, Any]:
+        """Encode scopes as weighted query matrices (scopes x vocabulary), one per field."""
+        import numpy as np
+
+        queries = {
+            field: np.zeros((len(scopes), len(tokens)), dtype=np.int32)
+            for field, tokens in self.vocab.items()
+        }
+        rules = self.scorer.rules
+        for row, scope in enumerate(scopes):
+            # Repeated services are counted each time, as in match_suppliers
+            for term in self.scorer.terms(scope):
+                field = rules[term.rule].field
+                queries[field][row, self.vocab[field][term.category]] += term.points
+        return queries
+
+    def score(self, scopes: List[Dict[Text, Any]]) -> Any:
+        """Return the (scopes x suppliers) score matrix."""
+        import numpy as np
+
+        queries = self.encode_scopes(scopes)
+        scores = np.full((len(scopes), len(self.suppliers)), self.scorer.base_score, dtype=np.int32)
+        for field, matrix in self.features.items():
+            scores += queries[field] @ matrix.T
+        return np.minimum(scores, self.scorer.max_score)
+
+    def top_k(self, scopes: List[Dict[Text, Any]], k: int = TOP_MATCHES) -> Iterator[List[Dict[Text, Any]]]:
+        """Yield the top ``k`` matches of each scope, ordered like ``match_suppliers``."""
+        import numpy as np
+
+        n_suppliers = len(self.suppliers)
+        k = min(k, n_suppliers)
+        if not k:
+            for _ in scopes:
+                yield []
+            return
+        scores = self.score(scopes)
+        # Unique key per supplier: higher score first, then lower catalog position
+        keys = scores.astype(np.int64) * n_suppliers - np.arange(n_suppliers)
+        candidates = np.argpartition(-keys, k - 1, axis=1)[:, :k]
+        candidate_keys = np.take_along_axis(keys, candidates, axis=1)
+        order = np.argsort(-candidate_keys, axis=1)
+        ranked = np.take_along_axis(candidates, order, axis=1)
+        for row, scope in enumerate(scopes):
+            top = [[int(supplier_id), int(scores[row, supplier_id])] for supplier_id in ranked[row]]
+            yield render_matches(top, dict(scope, services_needed=_services(scope)), self.scorer)
+
+
+def _services(scope: Dict[Text, Any]) -> List[Text]:
+    services = scope.get('services_needed') or []
+    return [services] if isinstance(services, str) else services
+
+
+def _chunks(lines: Iterable[Text], size: int) -> Iterator[List[Dict[Text, Any]]]:
+    chunk = []
+    for line in lines:
+        if line.strip():
+            chunk.append(json.loads(line))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def match_stream(source: TextIO, sink: TextIO, k: int = TOP_MATCHES, check: bool = False, chunk_size: int = CHUNK_SIZE) -> int:
+    """Match every scope read from ``source`` and write one JSON result per line to ``sink``.
+
+    With ``check`` each result is compared to ``match_suppliers`` and a mismatch raises
+    ``RuntimeError``. Returns the number of scopes processed.
+    """
+    catalog = get_catalog()
+    matrix = SupplierMatrix(get_scorer(catalog))
+    processed = 0
+    for scopes in _chunks(source, chunk_size):
+        for scope, matches in zip(scopes, matrix.top_k(scopes, k)):
+            if check:
+                expected = match_suppliers(
+                    scope.get('study_phase'),
+                    scope.get('therapeutic_area'),
+                    _services(scope),
+                    scope.get('patient_population'),
+                    limit=k,
+                    catalog=catalog
+                )
+                if matches != expected:
+                    raise RuntimeError(f"Batch result differs from match_suppliers for scope {scope}: {matches} != {expected}")
+            sink.write(json.dumps({'id': scope.get('id', processed), 'matches': matches}) + "\n")
+            processed += 1
+    return processed
+
+
+def main(argv: List[Text] = None) -> None:
+    parser = argparse.ArgumentParser(description="Match project scopes from a JSONL stream against the supplier catalog.")
+    parser.add_argument("input", nargs="?", default="-", help="JSONL file of scopes, '-' for stdin")
+    parser.add_argument("output", nargs="?", default="-", help="JSONL file for results, '-' for stdout")
+    parser.add_argument("--top-k", type=int, default=TOP_MATCHES)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--check", action="store_true", help="verify every result against the per-tracker scorer")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    sink = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        processed = match_stream(source, sink, args.top_k, args.check, args.chunk_size)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    print(f"Matched {processed} scopes.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+"""Supplier catalog stored outside the code and swapped in while the server runs.
+
+The source of truth is ``catalog/suppliers.yml`` (a CSV export works too). It is
+compiled into a compact binary file with interned strings, the category index and
+per-supplier category bitsets::
+
+    python -m actions.catalog build catalog/suppliers.yml catalog/suppliers.bin
+
+The action server memory-maps the binary file and reads supplier names, postings and
+bitsets in place, through ``memoryview`` casts over the mapping. Only the category
+tables, whose size depends on the vocabulary and not on the number of suppliers, are
+built on the heap. Every worker process on the host therefore shares one copy of the
+catalog in the page cache, also after a reload. A background thread polls the file
+and swaps in a new ``Catalog`` when it changes. Requests that are already running
+keep the catalog they started with. If no binary file exists, the YAML source is
+compiled in memory instead.
+
+Binary layout, all integers little-endian unsigned 32-bit unless noted::
+
+    magic "CROCAT02" | version (u64) | string count | supplier count
+    string offsets (string count + 1) | supplier name ids (supplier count)
+    per field in FIELDS:
+        value offsets (supplier count + 1) | value string ids
+        category count | category token ids | category name ids
+        postings offsets (category count + 1) | supplier ids
+        bitset bytes per supplier | bitsets (supplier count x bitset bytes, padded to 4)
+    UTF-8 string blob
+
+A category is a lowercased value (its token) with the spelling first seen in the
+catalog (its name). The postings of a category list the ids of the suppliers that have
+it, in catalog order; a supplier's bitset has bit ``i`` set if it has category ``i``.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Text, Tuple
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('specialties', 'therapeutic_areas', 'services')
+
+MAGIC = b"CROCAT02"
+HEADER = struct.Struct("<8sQII")
+
+CATALOG_DIR = Path(__file__).resolve().parent.parent / "catalog"
+DEFAULT_SOURCE = CATALOG_DIR / "suppliers.yml"
+DEFAULT_BINARY = CATALOG_DIR / "suppliers.bin"
+
+# Seconds between checks for a new catalog file, 0 disables hot reload
+POLL_SECONDS = float(os.environ.get("CRO_CATALOG_POLL_SECONDS", "5"))
+
+
+class CategoryRegistry:
+    """Assigns a small integer id to every lowercased category of each field.
+
+    Supplier records store their categories as bitsets over these ids.
+    """
+
+    __slots__ = ('ids', 'names')
+
+    def __init__(self) -> None:
+        self.ids = {field: {} for field in FIELDS}
+        # Category id -> name as first spelled in the catalog
+        self.names = {field: [] for field in FIELDS}
+
+    def assign(self, field: Text, name: Text) -> int:
+        token = sys.intern(name.lower())
+        category_id = self.ids[field].get(token)
+        if category_id is None:
+            category_id = self.ids[field][token] = len(self.names[field])
+            self.names[field].append(name)
+        return category_id
+
+    def bit(self, field: Text, token: Text) -> int:
+        """Bitmask of a lowercased category, 0 if no supplier lists it."""
+        category_id = self.ids[field].get(token)
+        return 0 if category_id is None else 1 << category_id
+
+    def decode(self, field: Text, bits: int) -> List[Text]:
+        names = self.names[field]
+        return [names[category_id] for category_id in range(bits.bit_length()) if bits >> category_id & 1]
+
+
+class Supplier:
+    """Compact supplier record: categories are bitsets over ``CategoryRegistry`` ids."""
+
+    __slots__ = ('id', 'name', 'specialties', 'therapeutic_areas', 'services')
+
+    def __init__(self, supplier_id: int, name: Text, specialties: int, therapeutic_areas: int, services: int) -> None:
+        self.id = supplier_id
+        self.name = name
+        self.specialties = specialties
+        self.therapeutic_areas = therapeutic_areas
+        self.services = services
+
+    def __repr__(self) -> Text:
+        return f"Supplier({self.id}, {self.name!r})"
+
+
+class Strings(Sequence):
+    """Strings of the catalog's UTF-8 blob, decoded on access.
+
+    With ``ids``, item ``i`` is the string ``ids[i]``, as for the supplier names.
+    """
+
+    def __init__(self, offsets: memoryview, blob: memoryview, ids: Optional[memoryview] = None) -> None:
+        self._offsets = offsets
+        self._blob = blob
+        self._ids = ids
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1 if self._ids is None else len(self._ids)
+
+    def __getitem__(self, i: Any) -> Any:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("string index out of range")
+        if self._ids is not None:
+            i = self._ids[i]
+        return str(self._blob[self._offsets[i]:self._offsets[i + 1]], "utf-8")
+
+
+class Records(Sequence):
+    """``Supplier`` records of a catalog, decoded from its bitsets on access."""
+
+    def __init__(self, catalog: "Catalog") -> None:
+        self._catalog = catalog
+
+    def __len__(self) -> int:
+        return len(self._catalog)
+
+    def __getitem__(self, i: Any) -> Any:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("supplier id out of range")
+        return self._catalog.record(i)
+
+
+class Catalog:
+    """Read-only view over a compiled catalog held in an ``mmap`` or ``bytes`` buffer.
+
+    ``index`` maps each field's lowercased categories to the ids of the suppliers that
+    list them. Its postings, the supplier names and the records are read from the buffer.
+    """
+
+    def __init__(self, buffer: Any, source: Optional[Text] = None) -> None:
+        self.source = source
+        self._buffer = buffer
+        view = memoryview(buffer)
+        magic, version, n_strings, n_suppliers = HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise ValueError(
+                f"{source or 'buffer'} is not a compiled supplier catalog of this version, "
+                f"rebuild it with 'python -m actions.catalog build'"
+            )
+        self.version = f"{version:016x}"
+
+        offset = HEADER.size
+        string_offsets, offset = _u32_column(view, offset, n_strings + 1)
+        names, offset = _u32_column(view, offset, n_suppliers)
+        sections = []
+        for field in FIELDS:
+            field_offsets, offset = _u32_column(view, offset, n_suppliers + 1)
+            ids, offset = _u32_column(view, offset, field_offsets[n_suppliers])
+            (n_categories,), offset = _u32_column(view, offset, 1)
+            tokens, offset = _u32_column(view, offset, n_categories)
+            category_names, offset = _u32_column(view, offset, n_categories)
+            postings_offsets, offset = _u32_column(view, offset, n_categories + 1)
+            postings, offset = _u32_column(view, offset, postings_offsets[n_categories])
+            (width,), offset = _u32_column(view, offset, 1)
+            bitsets = view[offset:offset + width * n_suppliers]
+            offset += _padded(width * n_suppliers)
+            sections.append((field, field_offsets, ids, tokens, category_names, postings_offsets, postings, width, bitsets))
+
+        self.strings = Strings(string_offsets, view[offset:])
+        self.suppliers = Strings(string_offsets, view[offset:], names)
+        self.registry = CategoryRegistry()
+        self.index = {}
+        self._columns = {}
+        self._bitsets = {}
+        for field, field_offsets, ids, tokens, category_names, postings_offsets, postings, width, bitsets in sections:
+            self._columns[field] = (field_offsets, ids)
+            self._bitsets[field] = (width, bitsets)
+            index = self.index[field] = {}
+            for category_id, (token_id, name_id) in enumerate(zip(tokens, category_names)):
+                token = sys.intern(self.strings[token_id])
+                self.registry.ids[field][token] = category_id
+                self.registry.names[field].append(self.strings[name_id])
+                index[token] = postings[postings_offsets[category_id]:postings_offsets[category_id + 1]]
+        self.records = Records(self)
+
+    def __len__(self) -> int:
+        return len(self.suppliers)
+
+    def record(self, supplier_id: int) -> Supplier:
+        bits = []
+        for field in FIELDS:
+            width, bitsets = self._bitsets[field]
+            bits.append(int.from_bytes(bitsets[supplier_id * width:(supplier_id + 1) * width], "little"))
+        return Supplier(supplier_id, self.suppliers[supplier_id], *bits)
+
+    def values(self, supplier_id: int, field: Text) -> List[Text]:
+        field_offsets, ids = self._columns[field]
+        return [self.strings[i] for i in ids[field_offsets[supplier_id]:field_offsets[supplier_id + 1]]]
+
+    def expertise(self, supplier_id: int) -> Dict[Text, List[Text]]:
+        """Compatibility view of one supplier in the old ``SUPPLIER_EXPERTISE`` entry shape."""
+        return {field: self.values(supplier_id, field) for field in FIELDS}
+
+    def as_dicts(self) -> Dict[Text, Dict[Text, List[Text]]]:
+        """Compatibility view of the whole catalog in the old ``SUPPLIER_EXPERTISE`` shape."""
+        return {supplier: self.expertise(supplier_id) for supplier_id, supplier in enumerate(self.suppliers)}
+
+
+def _u32_column(view: memoryview, offset: int, count: int) -> Tuple[memoryview, int]:
+    end = offset + 4 * count
+    return view[offset:end].cast("I"), end
+
+
+def _padded(size: int) -> int:
+    """``size`` rounded up to a multiple of 4, so the columns after it stay aligned."""
+    return size + -size % 4
+
+
+def read_source(path: Path) -> List[Dict[Text, Any]]:
+    """Read supplier records from a YAML or CSV catalog source.
+
+    CSV files have a ``name`` column plus one column per field holding ``;``-separated values.
+    """
+    path = Path(path)
+    if path.suffix in (".yml", ".yaml"):
+        import yaml
+
+        with open(path, encoding="utf-8") as f:
+            records = (yaml.safe_load(f) or {}).get("suppliers") or []
+    elif path.suffix == ".csv":
+        with open(path, encoding="utf-8", newline="") as f:
+            records = [
+                dict(row, **{field: [v.strip() for v in (row.get(field) or "").split(";") if v.strip()] for field in FIELDS})
+                for row in csv.DictReader(f)
+            ]
+    else:
+        raise ValueError(f"Unsupported catalog source '{path}', expected .yml, .yaml or .csv")
+
+    seen = set()
+    suppliers = []
+    for record in records:
+        name = (record.get("name") or "").strip()
+        if not name:
+            raise ValueError(f"Supplier without a name in {path}: {record}")
+        if name in seen:
+            raise ValueError(f"Duplicate supplier '{name}' in {path}")
+        seen.add(name)
+        suppliers.append({"name": name, **{field: [str(v) for v in record.get(field) or []] for field in FIELDS}})
+    return suppliers
+
+
+def compile_catalog(suppliers: List[Dict[Text, Any]]) -> bytes:
+    """Encode supplier records into the binary catalog format."""
+    strings = {}
+
+    def intern(value: Text) -> int:
+        return strings.setdefault(value, len(strings))
+
+    names = [intern(supplier["name"]) for supplier in suppliers]
+    columns = []
+    for field in FIELDS:
+        field_offsets = [0]
+        ids = []
+        for supplier in suppliers:
+            ids.extend(intern(value) for value in supplier.get(field, []))
+            field_offsets.append(len(ids))
+        columns.append((field_offsets, ids))
+
+    values = list(strings)
+    registry = CategoryRegistry()
+    sections = []
+    for field, (field_offsets, ids) in zip(FIELDS, columns):
+        # string id -> category id, so each distinct string is lowercased once
+        category_ids = {string_id: registry.assign(field, values[string_id]) for string_id in sorted(set(ids))}
+        members = [[] for _ in registry.names[field]]
+        width = (len(members) + 7) // 8
+        bitsets = []
+        for supplier_id in range(len(suppliers)):
+            mask = 0
+            for string_id in ids[field_offsets[supplier_id]:field_offsets[supplier_id + 1]]:
+                mask |= 1 << category_ids[string_id]
+            bitsets.append(mask.to_bytes(width, "little"))
+            while mask:
+                low = mask & -mask
+                members[low.bit_length() - 1].append(supplier_id)
+                mask ^= low
+        postings_offsets = [0]
+        for supplier_ids in members:
+            postings_offsets.append(postings_offsets[-1] + len(supplier_ids))
+        sections.append((
+            [intern(token) for token in registry.ids[field]],
+            [intern(name) for name in registry.names[field]],
+            postings_offsets,
+            [supplier_id for supplier_ids in members for supplier_id in supplier_ids],
+            width,
+            b"".join(bitsets),
+        ))
+
+    encoded = [value.encode("utf-8") for value in strings]
+    string_offsets = [0]
+    for value in encoded:
+        string_offsets.append(string_offsets[-1] + len(value))
+
+    digest = hashlib.blake2b(json.dumps(suppliers, sort_keys=True).encode("utf-8"), digest_size=8).digest()
+    parts = [
+        HEADER.pack(MAGIC, int.from_bytes(digest, "little"), len(strings), len(suppliers)),
+        _pack_u32(string_offsets),
+        _pack_u32(names),
+    ]
+    for (field_offsets, ids), (tokens, category_names, postings_offsets, postings, width, bitsets) in zip(columns, sections):
+        parts.extend([
+            _pack_u32(field_offsets),
+            _pack_u32(ids),
+            _pack_u32([len(tokens)]),
+            _pack_u32(tokens),
+            _pack_u32(category_names),
+            _pack_u32(postings_offsets),
+            _pack_u32(postings),
+            _pack_u32([width]),
+            bitsets.ljust(_padded(len(bitsets)), b"\0"),
+        ])
+    parts.extend(encoded)
+    return b"".join(parts)
+
+
+def _pack_u32(values: List[int]) -> bytes:
+    return struct.pack(f"<{len(values)}I", *values)
+
+
+def _replace_file(target: Path, data: bytes) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=target.parent, prefix=target.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # Readers keep mapping the old inode until they swap, so replacing is safe under load
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_catalog(suppliers: List[Dict[Text, Any]], target: Path) -> Catalog:
+    """Compile ``suppliers`` to ``target``, atomically replacing any previous version."""
+    target = Path(target)
+    data = compile_catalog(suppliers)
+    _replace_file(target, data)
+    return Catalog(data, str(target))
+
+
+def load_catalog(path: Path) -> Catalog:
+    """Memory-map a compiled catalog, or compile a YAML/CSV source in memory."""
+    path = Path(path)
+    if path.suffix != ".bin":
+        return Catalog(compile_catalog(read_source(path)), str(path))
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return Catalog(buffer, str(path))
+
+
+def catalog_path() -> Path:
+    configured = os.environ.get("CRO_CATALOG_PATH")
+    if configured:
+        return Path(configured)
+    return DEFAULT_BINARY if DEFAULT_BINARY.exists() else DEFAULT_SOURCE
+
+
+_lock = threading.Lock()
+_current: Optional[Catalog] = None
+_stamp: Optional[Tuple[Any, ...]] = None
+_watcher: Optional[threading.Thread] = None
+
+
+def _file_stamp(path: Path) -> Tuple[Any, ...]:
+    stat = os.stat(path)
+    return (str(path), stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def reload_catalog(force: bool = False) -> bool:
+    """Load the catalog again if its file changed. Returns whether a new catalog was swapped in."""
+    global _current, _stamp
+    path = catalog_path()
+    stamp = _file_stamp(path)
+    if not force and stamp == _stamp:
+        return False
+    catalog = load_catalog(path)
+    # A single reference assignment, so concurrent readers see either the old or the new catalog
+    _current, _stamp = catalog, stamp
+    logger.info(f"Loaded supplier catalog {catalog.version} ({len(catalog)} suppliers) from {path}")
+    return True
+
+
+def _after_fork() -> None:
+    """Forked workers share the loaded catalog, but the watcher thread stays in the parent."""
+    global _watcher, _lock
+    _watcher = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _watch() -> None:
+    while True:
+        time.sleep(POLL_SECONDS)
+        try:
+            reload_catalog()
+        except Exception:
+            logger.exception("Failed to reload the supplier catalog, keeping the current version")
+
+
+def get_catalog() -> Catalog:
+    """Return the current catalog, loading it and starting the file watcher on first use."""
+    global _watcher
+    catalog = _current
+    if catalog is not None and (_watcher is not None or POLL_SECONDS <= 0):
+        return catalog
+    with _lock:
+        if _current is None:
+            reload_catalog(force=True)
+        if _watcher is None and POLL_SECONDS > 0:
+            _watcher = threading.Thread(target=_watch, name="catalog-watcher", daemon=True)
+            _watcher.start()
+    return _current
+
+
+def main(argv: List[Text] = None) -> None:
+    parser = argparse.ArgumentParser(description="Build or inspect the compiled supplier catalog.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="compile a YAML or CSV source into a binary catalog")
+    build.add_argument("source", nargs="?", default=str(DEFAULT_SOURCE))
+    build.add_argument("target", nargs="?", default=str(DEFAULT_BINARY))
+    show = commands.add_parser("show", help="print the version and size of a catalog")
+    show.add_argument("path", nargs="?", default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        from actions.vocabulary import SNAPSHOT_PATH, write_snapshot
+
+        catalog = write_catalog(read_source(Path(args.source)), Path(args.target))
+        print(f"Wrote {args.target}: version {catalog.version}, {len(catalog)} suppliers, {len(catalog.strings)} strings")
+        write_snapshot()
+        print(f"Wrote {SNAPSHOT_PATH}")
+    else:
+        catalog = load_catalog(Path(args.path) if args.path else catalog_path())
+        print(f"{catalog.source}: version {catalog.version}, {len(catalog)} suppliers, {len(catalog.strings)} strings")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""Bounded cache of CRO rankings keyed on the normalized project scope.
+
+Entries are keyed on (study phase, therapeutic area, sorted services, patient
+population, scorer version), so a reloaded catalog or changed scoring rules never
+serve stale rankings.
+Entries of other versions are also dropped when the version changes. Entries expire after a TTL and
+the least recently used ones are evicted first. Configure with environment variables:
+
+``CRO_MATCH_CACHE``
+    ``memory`` (default), ``sqlite:<path>`` for a local on-disk cache shared by the
+    worker processes on the host, or ``off``.
+``CRO_MATCH_CACHE_SIZE``
+    Maximum number of entries, 1024 by default.
+``CRO_MATCH_CACHE_TTL``
+    Seconds an entry stays valid, 3600 by default.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Text, Tuple
+
+from actions.sqlite_db import ProcessConnection
+
+# Bumped whenever the shape of a cached ranking changes, so an on-disk cache never returns old entries
+KEY_FORMAT = 2
+# Position of the scorer version in a key, see MatchCache.key
+VERSION_FIELD = 5
+
+
+class MemoryBackend:
+    """In-process LRU store."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Text) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: Text, expires_at: float, value: Any) -> int:
+        """Store ``value`` and return how many entries were evicted to make room."""
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def delete(self, key: Text) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def retain(self, version: Text) -> None:
+        """Drop the entries of every scorer version but ``version``."""
+        with self._lock:
+            for key in [key for key in self._entries if json.loads(key)[VERSION_FIELD] != version]:
+                del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SqliteBackend:
+    """LRU store in a local SQLite file, values serialized as JSON."""
+
+    def __init__(self, path: Text, max_size: int) -> None:
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._connection = ProcessConnection(path, (
+            "CREATE TABLE IF NOT EXISTS match_cache (key TEXT PRIMARY KEY, expires_at REAL, used_at REAL, value TEXT)",
+            "CREATE INDEX IF NOT EXISTS match_cache_used_at ON match_cache (used_at)",
+        ))
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        return self._connection.get()
+
+    def get(self, key: Text) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT expires_at, value FROM match_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE match_cache SET used_at = ? WHERE key = ?", (time.time(), key))
+            return row[0], json.loads(row[1])
+
+    def set(self, key: Text, expires_at: float, value: Any) -> int:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO match_cache VALUES (?, ?, ?, ?)",
+                (key, expires_at, time.time(), json.dumps(value)),
+            )
+            excess = self._db.execute("SELECT COUNT(*) FROM match_cache").fetchone()[0] - self.max_size
+            if excess > 0:
+                self._db.execute(
+                    "DELETE FROM match_cache WHERE key IN "
+                    "(SELECT key FROM match_cache ORDER BY used_at LIMIT ?)",
+                    (excess,),
+                )
+            return max(excess, 0)
+
+    def delete(self, key: Text) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM match_cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM match_cache")
+
+    def retain(self, version: Text) -> None:
+        """Drop the entries of every scorer version but ``version``.
+
+        Other workers sharing the file keep their entries as long as they are on the same version.
+        """
+        with self._lock:
+            self._db.execute(f"DELETE FROM match_cache WHERE json_extract(key, '$[{VERSION_FIELD}]') IS NOT ?", (version,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM match_cache").fetchone()[0]
+
+
+class MatchCache:
+    def __init__(self, backend: Any, ttl: float) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._version = None
+
+    @staticmethod
+    def key(study_phase: Text, therapeutic_area: Text, services_needed: List[Text], patient_population: Text, limit: int, version: Text) -> Text:
+        return json.dumps([
+            (study_phase or "").lower(),
+            (therapeutic_area or "").lower(),
+            sorted(service.lower() for service in services_needed or []),
+            (patient_population or "").lower(),
+            limit,
+            version,
+            KEY_FORMAT,
+        ])
+
+    def get_or_compute(self, key: Text, version: Text, compute: Callable[[], Any]) -> Any:
+        value = self.lookup(key, version)
+        if value is None:
+            value = compute()
+            self.store(key, value)
+        return value
+
+    def lookup(self, key: Text, version: Text) -> Any:
+        """Return the cached value, or ``None`` on a miss. A miss should be followed by ``store``."""
+        if version != self._version:
+            # Not a clear: this also runs on a process's first lookup, and an on-disk cache is shared
+            self.backend.retain(version)
+            self._version = version
+        entry = self.backend.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.time():
+                self.hits += 1
+                return value
+            self.backend.delete(key)
+            self.expirations += 1
+        self.misses += 1
+        return None
+
+    def store(self, key: Text, value: Any) -> None:
+        self.evictions += self.backend.set(key, time.time() + self.ttl, value)
+
+    def stats(self) -> Dict[Text, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+def create_cache() -> Optional[MatchCache]:
+    setting = os.environ.get("CRO_MATCH_CACHE", "memory")
+    max_size = int(os.environ.get("CRO_MATCH_CACHE_SIZE", "1024"))
+    ttl = float(os.environ.get("CRO_MATCH_CACHE_TTL", "3600"))
+    if setting == "off":
+        return None
+    if setting == "memory":
+        return MatchCache(MemoryBackend(max_size), ttl)
+    if setting.startswith("sqlite:"):
+        return MatchCache(SqliteBackend(setting[len("sqlite:"):], max_size), ttl)
+    raise ValueError(f"Unknown CRO_MATCH_CACHE backend '{setting}', expected memory, sqlite:<path> or off")
+
+
+MATCH_CACHE = create_cache()
@@ -0,0 +1,405 @@
+"""Supplier ranking for ``ActionMatchCROs``.
+
+A scope is scored by the rules in ``actions.scoring``: each slot value a rule rewards
+adds points to the suppliers the catalog index lists for it. The top matches are
+taken with a heap, and each is explained rule by rule from the scope's terms.
+
+``PartialScores`` follows a conversation's scope while the form validates it. A
+validated slot only looks up the terms of its value, which the scorer caches for all
+conversations. Once every scoring slot is set, the top matches are ranked, so they are
+ready before ``action_match_cros`` runs; a later slot change ranks again only if it
+changes what the scope scores. An entry keeps the slot values, references to their
+terms and the top matches, so it costs the same whatever the catalog size. The entries
+of a process are bounded by ``CRO_PARTIAL_SCORES_BYTES`` (16 MiB by default), least
+recently used first out.
+
+With ``CRO_MATCH_PROCESSES`` set to a number of processes, full rankings, including
+those of ``PartialScores``, run in a process pool, so a large catalog does not block
+the event loop that serves form validation. Pool processes are forked from the action server and
+start with its loaded catalog.
+"""
+import asyncio
+import heapq
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Text, Tuple
+
+from actions.catalog import Catalog, get_catalog
+from actions.match_cache import MATCH_CACHE
+from actions.metrics import MATCH_CANDIDATES
+from actions.scoring import SLOTS, RuleHit, Scorer, Term, get_scorer
+
+logger = logging.getLogger(__name__)
+
+TOP_MATCHES = 5
+
+DIMENSIONS = SLOTS
+
+# Estimated bytes of partial scores kept in this process
+PARTIAL_SCORES_BYTES = int(os.environ.get("CRO_PARTIAL_SCORES_BYTES", str(16 * 1024 * 1024)))
+
+MATCH_PROCESSES = int(os.environ.get("CRO_MATCH_PROCESSES", "0"))
+
+
+def dimension_key(dimension: Text, value: Any) -> Any:
+    """Normalize a slot value to what scoring depends on."""
+    if isinstance(value, (list, tuple)):
+        return tuple(item.lower() for item in value)
+    return value.lower() if value else ""
+
+
+def top_matches(scores: Dict[int, int], limit: int, scorer: Scorer) -> List[List[int]]:
+    """Return ``[supplier id, score]`` for the top ``limit`` suppliers.
+
+    Suppliers in ``scores`` are ranked with a partial sort; everyone else keeps the base
+    score and fills the remaining places in catalog order, exactly as a full stable sort would.
+    """
+    max_score = scorer.max_score
+    ranked = heapq.nsmallest(limit, scores.items(), key=lambda item: (-min(item[1], max_score), item[0]))
+    top_suppliers = [[supplier_id, min(score, max_score)] for supplier_id, score in ranked]
+
+    # Suppliers with no match all tie on the base score, so fill up in catalog order
+    for supplier_id in range(len(scorer.catalog.suppliers)):
+        if len(top_suppliers) >= limit:
+            break
+        if supplier_id not in scores:
+            top_suppliers.append([supplier_id, scorer.base_score])
+    return top_suppliers
+
+
+def rank_suppliers(study_phase: Text, therapeutic_area: Text, services_needed: List[Text], patient_population: Text, limit: int, scorer: Scorer) -> List[List[int]]:
+    """Rank suppliers for a project scope without rendering reasons.
+
+    The result depends only on the lowercased scope, which is what makes it cacheable.
+    """
+    candidates, ranked = _rank(study_phase, therapeutic_area, services_needed, patient_population, limit, scorer)
+    MATCH_CANDIDATES.observe(candidates)
+    return ranked
+
+
+def _rank(study_phase: Text, therapeutic_area: Text, services_needed: List[Text], patient_population: Text, limit: int, scorer: Scorer) -> Tuple[int, List[List[int]]]:
+    """The number of suppliers scored, and the top ``limit`` of them."""
+    scope = _scope(study_phase, therapeutic_area, services_needed, patient_population)
+    scores = scorer.add({}, scorer.terms(scope))
+    return len(scores), top_matches(scores, limit, scorer)
+
+
+class PartialScores:
+    """One conversation's scope, as the scoring terms of each slot, and the top matches it ranks.
+
+    The terms of a slot value come from the scorer's shared ``slot_terms`` cache, so
+    updating a slot is a lookup. Rankings are kept until a slot changes what it scores.
+    """
+
+    __slots__ = ('version', 'keys', 'terms', 'size', 'candidates', '_top', '_pending')
+
+    def __init__(self, version: Text) -> None:
+        self.version = version
+        # Normalized value of each slot set so far
+        self.keys = {}
+        self.terms = {}
+        # Estimated bytes, as last accounted for in the cache
+        self.size = 0
+        # Suppliers scored by the current scope, recorded when the ranking is used
+        self.candidates = 0
+        self._top = {}
+        # (limit, future) of a ranking running in the match pool
+        self._pending = None
+
+    def update(self, dimension: Text, value: Any, scorer: Scorer) -> None:
+        key = dimension_key(dimension, value)
+        if dimension in self.keys and self.keys[dimension] == key:
+            return
+        self.keys[dimension] = key
+        terms = scorer.slot_terms(dimension, key)
+        # A value that scores like the previous one, such as one no rule rewards, keeps the rankings
+        if _signature(terms) == _signature(self.terms.get(dimension, ())):
+            return
+        self.terms[dimension] = terms
+        self._top = {}
+        self._pending = None
+
+    def complete(self) -> bool:
+        return len(self.keys) == len(DIMENSIONS)
+
+    def ranked(self, limit: int) -> Optional[List[List[int]]]:
+        return self._top.get(limit)
+
+    def pending(self, limit: int) -> Any:
+        """The future of a ranking for ``limit`` that runs in the match pool, if any."""
+        if self._pending is not None and self._pending[0] == limit:
+            return self._pending[1]
+        return None
+
+    def top(self, limit: int, scorer: Scorer) -> List[List[int]]:
+        if limit not in self._top:
+            scores = scorer.add({}, (term for terms in self.terms.values() for term in terms))
+            self.candidates = len(scores)
+            self._top[limit] = top_matches(scores, limit, scorer)
+        return self._top[limit]
+
+    def nbytes(self) -> int:
+        # Terms are shared with the scorer's cache, only the tuples referencing them count
+        size = sys.getsizeof(self) + sys.getsizeof(self.keys) + sys.getsizeof(self.terms) + sys.getsizeof(self._top)
+        for key in self.keys.values():
+            size += sys.getsizeof(key) + sum(map(sys.getsizeof, key) if isinstance(key, tuple) else ())
+        size += sum(map(sys.getsizeof, self.terms.values()))
+        for top in self._top.values():
+            size += sys.getsizeof(top) + sum(map(sys.getsizeof, top))
+        return size
+
+
+def _signature(terms: Tuple[Term, ...]) -> Tuple[Tuple[int, Text, int], ...]:
+    """What terms add to scores, regardless of the spelling of the slot value."""
+    return tuple(sorted((term.rule, term.category, term.points) for term in terms))
+
+
+_partial_scores = OrderedDict()
+_partial_scores_bytes = 0
+_partial_scores_lock = threading.Lock()
+
+
+def _partial_scores_for(sender_id: Text, scorer: Scorer, create: bool) -> Optional[PartialScores]:
+    global _partial_scores_bytes
+    with _partial_scores_lock:
+        partial = _partial_scores.get(sender_id)
+        if partial is not None and partial.version != scorer.version:
+            _partial_scores_bytes -= partial.size
+            del _partial_scores[sender_id]
+            partial = None
+        if partial is None:
+            if not create:
+                return None
+            partial = _partial_scores[sender_id] = PartialScores(scorer.version)
+        _partial_scores.move_to_end(sender_id)
+        return partial
+
+
+def _account(sender_id: Text, partial: PartialScores) -> None:
+    """Update the cache's size for a changed entry and evict the least recently used entries over the limit."""
+    global _partial_scores_bytes
+    size = partial.nbytes() + sys.getsizeof(sender_id)
+    with _partial_scores_lock:
+        if _partial_scores.get(sender_id) is not partial:
+            return
+        _partial_scores_bytes += size - partial.size
+        partial.size = size
+        while _partial_scores_bytes > PARTIAL_SCORES_BYTES and len(_partial_scores) > 1:
+            _, evicted = _partial_scores.popitem(last=False)
+            _partial_scores_bytes -= evicted.size
+
+
+def update_partial_scores(sender_id: Text, slot: Text, value: Any) -> None:
+    """Fold a newly validated slot into the conversation's scope.
+
+    Once every scoring slot is set, the top matches are ranked ahead of ``action_match_cros``:
+    in the match pool if there is one, otherwise right away. They are ranked again only
+    when a slot changes what the scope scores.
+    """
+    if slot not in DIMENSIONS:
+        return
+    scorer = get_scorer()
+    partial = _partial_scores_for(sender_id, scorer, create=True)
+    partial.update(slot, value, scorer)
+    if partial.complete() and partial.ranked(TOP_MATCHES) is None and partial.pending(TOP_MATCHES) is None:
+        pool = _match_pool()
+        if pool is None:
+            partial.top(TOP_MATCHES, scorer)
+        else:
+            _rank_later(sender_id, partial, TOP_MATCHES, pool)
+    _account(sender_id, partial)
+
+
+def discard_partial_scores(sender_id: Text) -> None:
+    global _partial_scores_bytes
+    with _partial_scores_lock:
+        partial = _partial_scores.pop(sender_id, None)
+        if partial is not None:
+            _partial_scores_bytes -= partial.size
+
+
+def match_suppliers(study_phase: Text, therapeutic_area: Text, services_needed: List[Text], patient_population: Text, limit: int = TOP_MATCHES, catalog: Optional[Catalog] = None, sender_id: Optional[Text] = None) -> List[Dict[Text, Any]]:
+    """Rank suppliers for a project scope, returning the top ``limit`` with score, reason and per-rule points.
+
+    With ``sender_id`` the ranking comes from the conversation's partial scores when the
+    form built them in this process; any slot that changed since is folded in first.
+    Otherwise it is served from ``MATCH_CACHE`` or computed in full. The whole ranking
+    uses one catalog snapshot even if a reload happens meanwhile.
+    """
+    scorer = get_scorer(catalog or get_catalog())
+    ranked = _partial_ranking(study_phase, therapeutic_area, services_needed, patient_population, limit, scorer, sender_id)
+    if ranked is None and MATCH_CACHE is None:
+        ranked = rank_suppliers(study_phase, therapeutic_area, services_needed, patient_population, limit, scorer)
+    elif ranked is None:
+        ranked = MATCH_CACHE.get_or_compute(
+            MATCH_CACHE.key(study_phase, therapeutic_area, services_needed, patient_population, limit, scorer.version),
+            scorer.version,
+            lambda: rank_suppliers(study_phase, therapeutic_area, services_needed, patient_population, limit, scorer)
+        )
+    return render_matches(ranked, _scope(study_phase, therapeutic_area, services_needed, patient_population), scorer)
+
+
+async def match_suppliers_async(study_phase: Text, therapeutic_area: Text, services_needed: List[Text], patient_population: Text, limit: int = TOP_MATCHES, sender_id: Optional[Text] = None) -> List[Dict[Text, Any]]:
+    """``match_suppliers`` for the event loop: a full ranking runs in the match process pool, if configured."""
+    catalog = get_catalog()
+    pool = _match_pool()
+    if pool is None:
+        return match_suppliers(study_phase, therapeutic_area, services_needed, patient_population, limit, catalog, sender_id)
+
+    scorer = get_scorer(catalog)
+    ranked = await _partial_ranking_async(study_phase, therapeutic_area, services_needed, patient_population, limit, scorer, sender_id, pool)
+    key = None
+    if ranked is None and MATCH_CACHE is not None:
+        key = MATCH_CACHE.key(study_phase, therapeutic_area, services_needed, patient_population, limit, scorer.version)
+        ranked = MATCH_CACHE.lookup(key, scorer.version)
+    if ranked is None:
+        version, candidates, ranked = await asyncio.get_running_loop().run_in_executor(
+            pool, _rank_in_pool, study_phase, therapeutic_area, services_needed, patient_population, limit
+        )
+        if version != scorer.version:
+            # The pool process had not picked up the same catalog version yet
+            ranked = rank_suppliers(study_phase, therapeutic_area, services_needed, patient_population, limit, scorer)
+        else:
+            # Metrics of the pool processes are never served, so the ranking is recorded here
+            MATCH_CANDIDATES.observe(candidates)
+        if key is not None:
+            MATCH_CACHE.store(key, ranked)
+    return render_matches(ranked, _scope(study_phase, therapeutic_area, services_needed, patient_population), scorer)
+
+
+def _scope(study_phase: Text, therapeutic_area: Text, services_needed: List[Text], patient_population: Text) -> Dict[Text, Any]:
+    return {
+        'therapeutic_area': therapeutic_area,
+        'services_needed': services_needed,
+        'study_phase': study_phase,
+        'patient_population': patient_population,
+    }
+
+
+def _current_partial(study_phase: Text, therapeutic_area: Text, services_needed: List[Text], patient_population: Text, scorer: Scorer, sender_id: Optional[Text]) -> Optional[PartialScores]:
+    """The conversation's partial scores with any slot that changed since validation folded in."""
+    partial = _partial_scores_for(sender_id, scorer, create=False) if sender_id else None
+    if partial is not None:
+        scope = _scope(study_phase, therapeutic_area, services_needed, patient_population)
+        for dimension in DIMENSIONS:
+            partial.update(dimension, scope[dimension], scorer)
+    return partial
+
+
+def _partial_ranking(study_phase: Text, therapeutic_area: Text, services_needed: List[Text], patient_population: Text, limit: int, scorer: Scorer, sender_id: Optional[Text]) -> Optional[List[List[int]]]:
+    partial = _current_partial(study_phase, therapeutic_area, services_needed, patient_population, scorer, sender_id)
+    if partial is None:
+        return None
+    top = partial.top(limit, scorer)
+    # Validation precomputes rankings too, but only the ones action_match_cros uses are recorded
+    MATCH_CANDIDATES.observe(partial.candidates)
+    _account(sender_id, partial)
+    return top
+
+
+async def _partial_ranking_async(study_phase: Text, therapeutic_area: Text, services_needed: List[Text], patient_population: Text, limit: int, scorer: Scorer, sender_id: Optional[Text], pool: Any) -> Optional[List[List[int]]]:
+    """``_partial_ranking`` that waits for, or starts, the ranking in the match pool instead of ranking on the loop."""
+    partial = _current_partial(study_phase, therapeutic_area, services_needed, patient_population, scorer, sender_id)
+    if partial is None:
+        return None
+    if partial.ranked(limit) is None:
+        await (partial.pending(limit) or _rank_later(sender_id, partial, limit, pool))
+    top = partial.ranked(limit)
+    if top is None:
+        # The pool process was on another catalog version, or the scope changed meanwhile
+        top = partial.top(limit, scorer)
+    MATCH_CANDIDATES.observe(partial.candidates)
+    _account(sender_id, partial)
+    return top
+
+
+def _rank_later(sender_id: Text, partial: PartialScores, limit: int, pool: Any) -> Any:
+    """Rank ``partial`` in the match pool and store the result in it. Returns the future, or ``None`` off the event loop."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    keys = partial.keys
+    future = loop.run_in_executor(
+        pool, _rank_in_pool, keys['study_phase'], keys['therapeutic_area'], keys['services_needed'], keys['patient_population'], limit
+    )
+    partial._pending = (limit, future)
+
+    def ranked(future: Any) -> None:
+        if partial._pending is None or partial._pending[1] is not future:
+            # The scope changed while it was ranked
+            return
+        partial._pending = None
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.error(f"Ranking the scope of {sender_id} in the match pool failed: {future.exception()!r}")
+            return
+        version, candidates, top = future.result()
+        # A pool process that has not reloaded the catalog yet ranked with the old version
+        if version == partial.version:
+            partial._top[limit] = top
+            partial.candidates = candidates
+            _account(sender_id, partial)
+
+    future.add_done_callback(ranked)
+    return future
+
+
+_pool: Any = None
+_pool_pid: Optional[int] = None
+
+
+def _match_pool() -> Any:
+    global _pool, _pool_pid
+    if MATCH_PROCESSES <= 0:
+        return None
+    # A pool inherited over fork belongs to the parent, so each worker process starts its own
+    if _pool_pid != os.getpid():
+        # Imported here, since multiprocessing is only needed when the pool is enabled
+        from concurrent.futures import ProcessPoolExecutor
+
+        _pool = ProcessPoolExecutor(MATCH_PROCESSES)
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def _rank_in_pool(study_phase: Text, therapeutic_area: Text, services_needed: List[Text], patient_population: Text, limit: int) -> Tuple[Text, int, List[List[int]]]:
+    scorer = get_scorer()
+    return (scorer.version, *_rank(study_phase, therapeutic_area, services_needed, patient_population, limit, scorer))
+
+
+def render_matches(ranked: List[List[int]], scope: Dict[Text, Any], scorer: Scorer) -> List[Dict[Text, Any]]:
+    """Name, score, reason and per-rule points of ranked suppliers, explained from the scope's terms.
+
+    The score shown is the total of the per-rule breakdown, so it always matches the reason.
+    """
+    terms = scorer.terms(scope)
+    top_suppliers = []
+    for supplier_id, ranked_score in ranked:
+        name = scorer.catalog.suppliers[supplier_id]
+        hits = scorer.explain(supplier_id, terms)
+        score = scorer.total(hits)
+        if score != ranked_score:
+            logger.error(
+                f"Explained score {score} of {name} differs from its ranked score {ranked_score} "
+                f"with scorer {scorer.version}"
+            )
+        top_suppliers.append({
+            'name': name,
+            'score': score,
+            'reason': _generate_reason(name, hits),
+            'rules': [{'rule': hit.rule, 'points': hit.points, 'values': list(hit.values)} for hit in hits],
+        })
+    return top_suppliers
+
+
+def _generate_reason(name: Text, hits: List[RuleHit]) -> Text:
+    reasons = [reason for hit in hits for reason in hit.reasons]
+    if reasons:
+        return f"{name} has {', '.join(reasons)}."
+    else:
+        return f"{name} offers comprehensive CRO services suitable for your project."
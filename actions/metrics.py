@@ -0,0 +1,247 @@
+"""Timing and counter instrumentation for the custom actions.
+
+Every action class is wrapped with ``instrument``, which records:
+
+- ``cro_action_duration_seconds``: latency histogram per action
+- ``cro_action_emitted_bytes_total``: bytes of text sent through ``dispatcher.utter_message``
+- ``cro_validator_calls_total`` and ``cro_validator_rejects_total``: per-slot validation outcomes
+- ``cro_match_candidates``: histogram of suppliers scored per ranking in ``ActionMatchCROs``
+
+Match cache and outbox statistics are exported as gauges. Configure with environment
+variables:
+
+``CRO_METRICS_PORT``
+    Serve the metrics in Prometheus text format on ``http://127.0.0.1:<port>/metrics``.
+    Disabled when unset. Metrics are kept per process: the workers of
+    ``python -m actions.server`` serve on consecutive ports, worker ``i`` (its
+    ``CRO_WORKER_INDEX``) on ``<port> + i``, so scrape each of them.
+``CRO_PROFILE_SAMPLE_RATE``
+    Fraction of action runs to profile with cProfile, 0 (off) by default. Profiles are
+    written to ``CRO_PROFILE_DIR`` (``profiles`` by default) and can be read with ``pstats``.
+"""
+import bisect
+import functools
+import inspect
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Text, Tuple
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SIZE_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+PROFILE_SAMPLE_RATE = float(os.environ.get("CRO_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = Path(os.environ.get("CRO_PROFILE_DIR", "profiles"))
+
+
+class Histogram:
+    def __init__(self, name: Text, help_text: Text, buckets: Tuple[float, ...]) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._series = {}
+
+    def observe(self, value: float, **labels: Text) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self) -> List[Text]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(key)} {values[-1]}")
+            lines.append(f"{self.name}_count{_labels(key)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: Text, help_text: Text) -> None:
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        self._values = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels: Text) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] += amount
+
+    def render(self) -> List[Text]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        lines.extend(f"{self.name}{_labels(key)} {value}" for key, value in values.items())
+        return lines
+
+
+def _labels(key: Tuple[Tuple[Text, Text], ...]) -> Text:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in key) + "}"
+
+
+ACTION_DURATION = Histogram("cro_action_duration_seconds", "Time spent in an action run.", LATENCY_BUCKETS)
+ACTION_ERRORS = Counter("cro_action_errors_total", "Action runs that raised an exception.")
+EMITTED_BYTES = Counter("cro_action_emitted_bytes_total", "Bytes of text sent through dispatcher.utter_message.")
+VALIDATOR_CALLS = Counter("cro_validator_calls_total", "Slot values validated for the requested slot.")
+VALIDATOR_REJECTS = Counter("cro_validator_rejects_total", "Slot values rejected by a validator.")
+MATCH_CANDIDATES = Histogram("cro_match_candidates", "Suppliers scored per ranking.", SIZE_BUCKETS)
+
+METRICS = [ACTION_DURATION, ACTION_ERRORS, EMITTED_BYTES, VALIDATOR_CALLS, VALIDATOR_REJECTS, MATCH_CANDIDATES]
+
+# Callables returning {gauge name: value}, evaluated when the metrics are scraped
+GAUGE_SOURCES: List[Callable[[], Dict[Text, Any]]] = []
+
+
+def render() -> Text:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for source in GAUGE_SOURCES:
+        try:
+            gauges = source()
+        except Exception:
+            logger.exception("Failed to collect gauges")
+            continue
+        for name, value in gauges.items():
+            if value is not None:
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _metrics_server(port: int) -> Any:
+    # http.server is only imported when metrics are served, to keep it out of the action server's startup
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: Text, *args: Any) -> None:
+            pass
+
+    return ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+
+
+_server: Any = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server() -> None:
+    """Serve ``/metrics`` from a background thread if ``CRO_METRICS_PORT`` is set."""
+    global _server
+    port = os.environ.get("CRO_METRICS_PORT")
+    if not port or _server is not None:
+        return
+    with _server_lock:
+        if _server is not None:
+            return
+        # Each pre-forked worker serves its own metrics on the next port
+        port = int(port) + int(os.environ.get("CRO_WORKER_INDEX", "0"))
+        try:
+            _server = _metrics_server(port)
+        except OSError:
+            logger.warning(f"Could not serve metrics on port {port}")
+            _server = False
+            return
+        threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+
+
+def _emitted_bytes(dispatcher: Any, before: int) -> int:
+    return sum(len((message.get("text") or "").encode("utf-8")) for message in dispatcher.messages[before:])
+
+
+def _profile_path(action: Text) -> Path:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    return PROFILE_DIR / f"{action}-{os.getpid()}-{time.time_ns()}.prof"
+
+
+@contextmanager
+def _measured(action: Text, dispatcher: Any) -> Iterator[None]:
+    start_metrics_server()
+    before = len(dispatcher.messages)
+    profiler = None
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        import cProfile
+
+        profiler = cProfile.Profile()
+    started = time.perf_counter()
+    try:
+        if profiler:
+            # For async actions, other tasks that run while this one awaits are included too
+            profiler.enable()
+        yield
+    except Exception:
+        ACTION_ERRORS.inc(action=action)
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(_profile_path(action))
+        ACTION_DURATION.observe(time.perf_counter() - started, action=action)
+        EMITTED_BYTES.inc(_emitted_bytes(dispatcher, before), action=action)
+
+
+def _wrap_run(run: Callable) -> Callable:
+    if inspect.iscoroutinefunction(run):
+        @functools.wraps(run)
+        async def timed_run(self, dispatcher, tracker, domain):
+            with _measured(self.name(), dispatcher):
+                return await run(self, dispatcher, tracker, domain)
+    else:
+        @functools.wraps(run)
+        def timed_run(self, dispatcher, tracker, domain):
+            with _measured(self.name(), dispatcher):
+                return run(self, dispatcher, tracker, domain)
+    return timed_run
+
+
+def _wrap_validator(slot: Text, validate: Callable) -> Callable:
+    @functools.wraps(validate)
+    def counted_validate(self, value, dispatcher, tracker, domain):
+        result = validate(self, value, dispatcher, tracker, domain)
+        # Validators pass other slots through unchanged, only the requested slot is validated
+        if tracker.get_slot("requested_slot") == slot:
+            VALIDATOR_CALLS.inc(slot=slot)
+            if result.get(slot) is None:
+                VALIDATOR_REJECTS.inc(slot=slot)
+        return result
+    return counted_validate
+
+
+def instrument(cls: type) -> type:
+    """Class decorator adding latency, output and validation metrics to an action."""
+    cls.run = _wrap_run(cls.run)
+    for attribute, method in list(vars(cls).items()):
+        if attribute.startswith("validate_") and callable(method):
+            setattr(cls, attribute, _wrap_validator(attribute[len("validate_"):], method))
+    return cls
@@ -0,0 +1,273 @@
+"""Durable outbox for handing project scopes over to the selected CRO.
+
+``ActionSendProject`` only appends the scope to a local SQLite outbox and returns.
+A background task on the action server's event loop delivers queued items in
+batches over a pooled HTTP session. Failures are retried with exponential backoff.
+Every item carries an ``Idempotency-Key`` header so the receiver can drop duplicates.
+Each worker process of the action server runs a delivery task on the shared outbox;
+items are claimed before they are sent, so each is sent by one process at a time.
+Configure with environment variables:
+
+``CRO_DELIVERY_URL``
+    Endpoint that receives the scopes as JSON ``POST`` requests. Without it items
+    are queued but not delivered, and the action server logs a warning at startup.
+``CRO_OUTBOX_PATH``
+    SQLite file of the outbox, ``outbox.db`` in the working directory by default.
+``CRO_OUTBOX_KEY_TTL``
+    Seconds after delivery during which sending the same scope again is treated as a
+    duplicate, 86400 by default. Afterwards it is queued and delivered again.
+
+A project whose delivery failed for good is queued again when it is sent again.
+
+The delivery worker starts with the action server (``start_delivery_with_server``), so
+items left pending by a restart are delivered without waiting for a new project.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Text, Tuple
+
+from actions.sqlite_db import ProcessConnection
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+MAX_CONNECTIONS = 10
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 300.0
+POLL_SECONDS = 1.0
+REQUEST_TIMEOUT_SECONDS = 10.0
+# How long a worker process holds the items it claimed, well beyond one request
+LEASE_SECONDS = 60.0
+KEY_TTL_SECONDS = float(os.environ.get("CRO_OUTBOX_KEY_TTL", "86400"))
+
+PENDING = "pending"
+# Claimed by a worker process that is delivering it
+SENDING = "sending"
+DELIVERED = "delivered"
+FAILED = "failed"
+# Result of an enqueue that added the item, or queued a failed or expired one again
+QUEUED = "queued"
+
+
+def idempotency_key(sender_id: Text, cro_name: Text, scope: Dict[Text, Any]) -> Text:
+    """Derive a stable key, so sending the same scope to the same CRO twice queues it once."""
+    content = json.dumps([sender_id, cro_name, scope], sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class Outbox:
+    def __init__(self, path: Text) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = ProcessConnection(path, (
+            "PRAGMA synchronous=NORMAL",
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY, idempotency_key TEXT UNIQUE, payload TEXT, status TEXT, "
+            "attempts INTEGER DEFAULT 0, created_at REAL, next_attempt_at REAL, "
+            "delivered_at REAL, last_error TEXT)",
+            "CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)",
+        ))
+        # Seconds from enqueue to successful delivery of recent items
+        self.latencies = deque(maxlen=1000)
+        self.delivered = 0
+        self.failed = 0
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        return self._connection.get()
+
+    def enqueue(self, payload: Dict[Text, Any], key: Text) -> Text:
+        """Queue ``payload`` for delivery.
+
+        Returns ``QUEUED`` if it was queued. An item under ``key`` that failed for good,
+        or was delivered more than ``KEY_TTL_SECONDS`` ago, is queued again. Otherwise
+        nothing is queued and the status of the existing item is returned: ``PENDING``
+        or ``SENDING`` while it waits for delivery, ``DELIVERED`` once it was delivered.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO outbox (idempotency_key, payload, status, created_at, next_attempt_at) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (idempotency_key) DO UPDATE SET payload = excluded.payload, status = excluded.status, "
+                "attempts = 0, created_at = excluded.created_at, next_attempt_at = excluded.next_attempt_at, "
+                "delivered_at = NULL, last_error = NULL "
+                "WHERE outbox.status = ? OR (outbox.status = ? AND outbox.delivered_at < ?)",
+                (key, json.dumps(payload), PENDING, now, now, FAILED, DELIVERED, now - KEY_TTL_SECONDS),
+            )
+            if cursor.rowcount == 1:
+                return QUEUED
+            return self._db.execute("SELECT status FROM outbox WHERE idempotency_key = ?", (key,)).fetchone()[0]
+
+    def due(self, limit: int) -> List[Tuple[Any, ...]]:
+        """Claim up to ``limit`` items that are due for delivery.
+
+        Claimed items are ``SENDING`` for ``LEASE_SECONDS``, so the other worker processes
+        sharing the outbox skip them. Items whose lease ran out, because the process
+        sending them died, are due again.
+        """
+        now = time.time()
+        with self._lock:
+            db = self._db
+            # BEGIN IMMEDIATE takes the write lock first, so no other process claims the same rows
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                items = db.execute(
+                    "SELECT id, idempotency_key, payload, attempts, created_at FROM outbox "
+                    "WHERE status IN (?, ?) AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                    (PENDING, SENDING, now, limit),
+                ).fetchall()
+                # While an item is sending, next_attempt_at holds the end of its lease
+                db.executemany(
+                    "UPDATE outbox SET status = ?, next_attempt_at = ? WHERE id = ?",
+                    [(SENDING, now + LEASE_SECONDS, item[0]) for item in items],
+                )
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+            return items
+
+    def mark_delivered(self, item_id: int, created_at: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute("UPDATE outbox SET status = ?, delivered_at = ? WHERE id = ?", (DELIVERED, now, item_id))
+        self.latencies.append(now - created_at)
+        self.delivered += 1
+
+    def mark_failed(self, item_id: int, attempts: int, error: Text) -> None:
+        if attempts >= MAX_ATTEMPTS:
+            status, next_attempt_at = FAILED, None
+            self.failed += 1
+            logger.error(f"Giving up on outbox item {item_id} after {attempts} attempts: {error}")
+        else:
+            delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+            status, next_attempt_at = PENDING, time.time() + delay * random.uniform(0.5, 1.0)
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (status, attempts, next_attempt_at, error, item_id),
+            )
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status IN (?, ?)", (PENDING, SENDING)
+            ).fetchone()[0]
+
+    def stats(self) -> Dict[Text, Any]:
+        latencies = sorted(self.latencies)
+        return {
+            "queue_depth": self.depth(),
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "latency_p50": latencies[len(latencies) // 2] if latencies else None,
+            "latency_max": latencies[-1] if latencies else None,
+        }
+
+
+class DeliveryWorker:
+    """Delivers due outbox items from the running event loop."""
+
+    def __init__(self, outbox: Outbox, url: Text) -> None:
+        self.outbox = outbox
+        self.url = url
+        self._task = None
+        self._wakeup = None
+
+    def ensure_started(self) -> None:
+        """Start the worker on the running loop if it is not running yet, and wake it up."""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS)
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT_SECONDS)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            while True:
+                try:
+                    delivered = await self.deliver_batch(session)
+                except Exception:
+                    logger.exception("Outbox delivery failed")
+                    delivered = 0
+                if delivered < BATCH_SIZE:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), POLL_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+
+    async def deliver_batch(self, session: Any) -> int:
+        """Send one batch of due items concurrently. Returns how many were attempted."""
+        # SQLite calls are short and local, so they run on the loop thread
+        items = self.outbox.due(BATCH_SIZE)
+        await asyncio.gather(*(self._deliver(session, *item) for item in items))
+        return len(items)
+
+    async def _deliver(self, session: Any, item_id: int, key: Text, payload: Text, attempts: int, created_at: float) -> None:
+        try:
+            async with session.post(
+                self.url,
+                data=payload,
+                headers={"Content-Type": "application/json", "Idempotency-Key": key},
+            ) as response:
+                if response.status < 300:
+                    self.outbox.mark_delivered(item_id, created_at)
+                    return
+                error = f"HTTP {response.status}"
+        except Exception as e:
+            error = repr(e)
+        self.outbox.mark_failed(item_id, attempts + 1, error)
+
+
+OUTBOX = Outbox(os.environ.get("CRO_OUTBOX_PATH", "outbox.db"))
+
+_worker: Optional[DeliveryWorker] = None
+
+
+def start_delivery() -> None:
+    """Make sure the delivery worker runs on the current event loop, if an endpoint is configured."""
+    global _worker
+    url = os.environ.get("CRO_DELIVERY_URL")
+    if not url:
+        return
+    if _worker is None:
+        _worker = DeliveryWorker(OUTBOX, url)
+    _worker.ensure_started()
+
+
+async def _start_delivery_listener(app: Any, loop: Any) -> None:
+    if not os.environ.get("CRO_DELIVERY_URL"):
+        logger.warning(
+            f"CRO_DELIVERY_URL is not set: projects sent to CROs are queued in {OUTBOX.path} "
+            f"but not delivered until it is set and the action server restarts"
+        )
+    start_delivery()
+
+
+def start_delivery_with_server(app_name: Text = "rasa_sdk") -> None:
+    """Start delivery once the Sanic action server named ``app_name`` is serving, if there is one.
+
+    ``rasa_sdk`` creates its Sanic app before it imports the actions, so the app can be
+    looked up from here. Outside the action server, for example in a replay, this does nothing.
+    """
+    try:
+        from sanic import Sanic
+
+        app = Sanic.get_app(app_name)
+    except Exception:
+        return
+    app.register_listener(_start_delivery_listener, "after_server_start")
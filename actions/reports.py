@@ -0,0 +1,280 @@
+"""Rendering of project scopes as chat text, Markdown, JSON and HTML.
+
+Every format is built from templates compiled once at import into literal and field
+segments. A render fills in the fields and joins all pieces in a single ``join``.
+Rendered output is cached on the scope slots, so repeating a scope costs a dict lookup.
+
+Formats:
+
+``scope``, ``report``, ``handoff``, ``already_sent``
+    The chat messages of ``action_output_project_scope`` and ``action_send_project``.
+``text``
+    The scope and report messages together, for exports.
+``markdown``, ``json``, ``html``
+    Documents for CRO handoff. ``html`` is print-ready, so it can be saved as PDF from a browser.
+
+``write_export`` streams many scopes into one document, writing each scope as it is
+rendered instead of building the whole export in memory::
+
+    python -m actions.reports scopes.jsonl export.html --format html
+"""
+import argparse
+import html
+import json
+import string
+import sys
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Text, TextIO, Tuple
+
+RENDER_CACHE_SIZE = 1024
+
+
+class Scope(NamedTuple):
+    """The slots a report is rendered from. Hashable, so it can key the render cache."""
+
+    study_phase: Optional[Text] = None
+    therapeutic_area: Optional[Text] = None
+    services_needed: Optional[Tuple[Text, ...]] = None
+    patient_population: Optional[Text] = None
+    timeline: Optional[Text] = None
+    cro_name: Optional[Text] = None
+
+    @classmethod
+    def from_slots(cls, slots: Mapping[Text, Any]) -> "Scope":
+        # List slots become tuples to keep the scope hashable
+        values = {field: slots.get(field) for field in cls._fields}
+        return cls(**{field: tuple(value) if isinstance(value, list) else value for field, value in values.items()})
+
+    @classmethod
+    def from_tracker(cls, tracker: Any) -> "Scope":
+        return cls.from_slots({field: tracker.get_slot(field) for field in cls._fields})
+
+
+class Template:
+    """A ``str.format`` style template split once into literal text and field names."""
+
+    __slots__ = ('literals', 'fields')
+
+    def __init__(self, source: Text) -> None:
+        parsed = list(string.Formatter().parse(source))
+        self.literals = tuple(literal for literal, _, _, _ in parsed)
+        self.fields = tuple(field for _, field, _, _ in parsed)
+
+    def chunks(self, values: Mapping[Text, Text]) -> Iterator[Text]:
+        for literal, field in zip(self.literals, self.fields):
+            yield literal
+            if field is not None:
+                yield values[field]
+
+
+# Labels in the order fields are listed
+LABELS = (
+    ('study_phase', "Study Phase"),
+    ('therapeutic_area', "Therapeutic Area"),
+    ('services_needed', "Services Needed"),
+    ('patient_population', "Patient Population"),
+    ('timeline', "Timeline"),
+)
+
+SCOPE_HEADER = "Project Scope:\n"
+SCOPE_LINES = tuple((field, Template(f"• {label}: {{{field}}}\n")) for field, label in LABELS)
+SCOPE_EMPTY = "Project information is not available."
+
+REPORT_HEADER = "Project Report:\n"
+REPORT_PHASE_AND_AREA = Template("This project is designed as a {study_phase} clinical study in the therapeutic area of {therapeutic_area}.")
+REPORT_PHASE = Template("This project is designed as a {study_phase} clinical study.")
+REPORT_AREA = Template("This project focuses on the therapeutic area of {therapeutic_area}.")
+REPORT_LINES = (
+    ('patient_population', Template("The target patient population consists of {patient_population}.")),
+    ('services_needed', Template("Key services required for this project include: {services_needed}.")),
+    ('timeline', Template("The anticipated project duration is {timeline}.")),
+)
+REPORT_EMPTY = "Project details are incomplete."
+
+HANDOFF = Template(
+    "Perfect! Your project details have been sent to {cro_name}!\n\n"
+    "Project Summary:\n"
+    "• Study Phase: {study_phase}\n"
+    "• Therapeutic Area: {therapeutic_area}\n"
+    "• Services Needed: {services_or_default}\n"
+    "• Patient Population: {patient_population}\n"
+    "• Timeline: {timeline}\n\n"
+    "{cro_name} will contact you within 24-48 hours to discuss your project in detail."
+)
+
+ALREADY_SENT = Template(
+    "Your project details were already sent to {cro_name}.\n\n"
+    "{cro_name} will contact you within 24-48 hours to discuss your project in detail."
+)
+
+MARKDOWN_HEADER = Template("## Project Scope{title}\n\n| Field | Value |\n| --- | --- |\n")
+MARKDOWN_ROWS = tuple((field, Template(f"| {label} | {{{field}}} |\n")) for field, label in LABELS)
+MARKDOWN_REPORT = Template("\n### Project Report\n\n{report}\n")
+
+HTML_DOCUMENT_HEADER = (
+    "<!DOCTYPE html>\n<html lang=\"en\">\n<head>\n<meta charset=\"utf-8\">\n<title>Project Scopes</title>\n"
+    "<style>\n"
+    "@page { size: A4; margin: 2cm; }\n"
+    "body { font-family: Helvetica, Arial, sans-serif; font-size: 11pt; color: #222; }\n"
+    "article { page-break-after: always; }\n"
+    "dt { font-weight: bold; float: left; clear: left; width: 11em; }\n"
+    "dd { margin: 0 0 0.4em 11em; }\n"
+    "</style>\n</head>\n<body>\n"
+)
+HTML_DOCUMENT_FOOTER = "</body>\n</html>\n"
+HTML_HEADER = Template("<article>\n<h1>Project Scope{title}</h1>\n<dl>\n")
+HTML_ROWS = tuple((field, Template(f"<dt>{label}</dt><dd>{{{field}}}</dd>\n")) for field, label in LABELS)
+HTML_REPORT = Template("</dl>\n<h2>Project Report</h2>\n<p>{report}</p>\n</article>\n")
+
+
+def _values(scope: Scope, escape: Callable[[Text], Text] = str) -> Dict[Text, Text]:
+    """Slot values as display strings; an unset slot renders as ``None`` like an f-string would."""
+    values = {field: escape(str(value)) for field, value in zip(Scope._fields, scope)}
+    if scope.services_needed:
+        values['services_needed'] = escape(', '.join(scope.services_needed))
+    values['services_or_default'] = values['services_needed'] if scope.services_needed else "Not specified"
+    return values
+
+
+def _rows(scope: Scope, rows: Tuple[Tuple[Text, Template], ...], values: Mapping[Text, Text]) -> Iterator[Text]:
+    for field, template in rows:
+        if getattr(scope, field):
+            yield from template.chunks(values)
+
+
+def _report_sentences(scope: Scope, values: Mapping[Text, Text]) -> List[Text]:
+    if scope.study_phase and scope.therapeutic_area:
+        opening = REPORT_PHASE_AND_AREA
+    elif scope.study_phase:
+        opening = REPORT_PHASE
+    elif scope.therapeutic_area:
+        opening = REPORT_AREA
+    else:
+        opening = None
+    templates = [opening] if opening else []
+    templates.extend(template for field, template in REPORT_LINES if getattr(scope, field))
+    return ["".join(template.chunks(values)) for template in templates]
+
+
+def _scope_chunks(scope: Scope) -> Iterator[Text]:
+    if not any(getattr(scope, field) for field, _ in LABELS):
+        yield SCOPE_EMPTY
+        return
+    yield SCOPE_HEADER
+    yield from _rows(scope, SCOPE_LINES, _values(scope))
+
+
+def _report_chunks(scope: Scope) -> Iterator[Text]:
+    yield REPORT_HEADER
+    yield "\n".join(_report_sentences(scope, _values(scope))) or REPORT_EMPTY
+
+
+def _handoff_chunks(scope: Scope) -> Iterator[Text]:
+    yield from HANDOFF.chunks(_values(scope))
+
+
+def _already_sent_chunks(scope: Scope) -> Iterator[Text]:
+    yield from ALREADY_SENT.chunks(_values(scope))
+
+
+def _text_chunks(scope: Scope) -> Iterator[Text]:
+    yield from _scope_chunks(scope)
+    yield "\n\n"
+    yield from _report_chunks(scope)
+
+
+def _markdown_chunks(scope: Scope) -> Iterator[Text]:
+    values = _values(scope)
+    values['title'] = f" for {scope.cro_name}" if scope.cro_name else ""
+    values['report'] = " ".join(_report_sentences(scope, values)) or REPORT_EMPTY
+    yield from MARKDOWN_HEADER.chunks(values)
+    yield from _rows(scope, MARKDOWN_ROWS, _values(scope, _escape_markdown))
+    yield from MARKDOWN_REPORT.chunks(values)
+
+
+def _json_chunks(scope: Scope) -> Iterator[Text]:
+    document = scope._asdict()
+    document['services_needed'] = list(scope.services_needed or [])
+    document['report'] = " ".join(_report_sentences(scope, _values(scope))) or REPORT_EMPTY
+    yield json.dumps(document)
+
+
+def _html_chunks(scope: Scope) -> Iterator[Text]:
+    values = _values(scope, html.escape)
+    values['title'] = f" for {values['cro_name']}" if scope.cro_name else ""
+    values['report'] = " ".join(_report_sentences(scope, values)) or REPORT_EMPTY
+    yield from HTML_HEADER.chunks(values)
+    yield from _rows(scope, HTML_ROWS, values)
+    yield from HTML_REPORT.chunks(values)
+
+
+def _escape_markdown(value: Text) -> Text:
+    return value.replace("|", "\\|")
+
+
+class Format(NamedTuple):
+    chunks: Callable[[Scope], Iterator[Text]]
+    # How ``write_export`` frames the rendered scopes
+    header: Text = ""
+    separator: Text = ""
+    footer: Text = ""
+
+
+FORMATS = {
+    'scope': Format(_scope_chunks, separator="\n\n"),
+    'report': Format(_report_chunks, separator="\n\n"),
+    'handoff': Format(_handoff_chunks, separator="\n\n"),
+    'already_sent': Format(_already_sent_chunks, separator="\n\n"),
+    'text': Format(_text_chunks, separator="\n\n\n", footer="\n"),
+    'markdown': Format(_markdown_chunks, separator="\n"),
+    'json': Format(_json_chunks, header="[\n", separator=",\n", footer="\n]\n"),
+    'html': Format(_html_chunks, header=HTML_DOCUMENT_HEADER, footer=HTML_DOCUMENT_FOOTER),
+}
+
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render(scope: Scope, format: Text = 'text') -> Text:
+    """Render one scope. ``html`` renders a complete document, the other formats a fragment."""
+    rendered = "".join(FORMATS[format].chunks(scope))
+    if format == 'html':
+        return "".join((HTML_DOCUMENT_HEADER, rendered, HTML_DOCUMENT_FOOTER))
+    return rendered
+
+
+def write_export(scopes: Iterable[Scope], sink: TextIO, format: Text = 'html') -> int:
+    """Write ``scopes`` to ``sink`` as one document, one scope at a time. Returns how many were written."""
+    spec = FORMATS[format]
+    sink.write(spec.header)
+    written = 0
+    for scope in scopes:
+        if written:
+            sink.write(spec.separator)
+        # Exports are mostly distinct scopes, so they bypass the render cache
+        sink.write("".join(spec.chunks(scope)))
+        written += 1
+    sink.write(spec.footer)
+    return written
+
+
+def main(argv: List[Text] = None) -> None:
+    parser = argparse.ArgumentParser(description="Export project scopes from a JSONL stream as one document.")
+    parser.add_argument("input", nargs="?", default="-", help="JSONL file of scopes, '-' for stdin")
+    parser.add_argument("output", nargs="?", default="-", help="export file, '-' for stdout")
+    parser.add_argument("--format", choices=sorted(FORMATS), default='html')
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    sink = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        scopes = (Scope.from_slots(json.loads(line)) for line in source if line.strip())
+        written = write_export(scopes, sink, args.format)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    print(f"Exported {written} scopes.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""Weighted scoring rules for ``ActionMatchCROs``, loaded from ``catalog/scoring.yml``.
+
+Set ``CRO_SCORING_RULES`` to load another rules file. Each rule reads one scope slot
+and adds its weight to every supplier that lists the slot value, or the category the
+value ``requires``, in one catalog field. See the rules file for the format.
+
+``Scorer`` compiles the rules against one catalog. A scope becomes a list of ``Term``s,
+one per matching slot value, each holding the ids of the suppliers it rewards from the
+catalog index and the category bit it tests on a supplier record. Ranking adds up the
+terms' points. ``explain`` breaks a ranked supplier's score down by rule from the same
+terms. The score and the reasons shown to the user are both rendered from that
+breakdown (``total`` adds it up), so they cannot disagree, and a breakdown that does
+not add up to the ranked score is logged as an error. ``actions.batch_match`` encodes the terms
+as NumPy query matrices.
+
+Categories that a rule requires but no supplier lists can never score. They are
+logged when a scorer is compiled. To list them, with the form choices no rule can reward::
+
+    python -m actions.scoring [rules.yml]
+"""
+import argparse
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Text, Tuple, Union
+
+from actions.catalog import CATALOG_DIR, FIELDS, Catalog, get_catalog
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RULES = CATALOG_DIR / "scoring.yml"
+
+# The scope slots a rule can read, in the order ActionMatchCROs passes them to scoring
+SLOTS = ('therapeutic_area', 'services_needed', 'study_phase', 'patient_population')
+
+# Scorers kept for the most recent catalog versions
+SCORERS_KEPT = 4
+
+
+class Rule(NamedTuple):
+    name: Text
+    slot: Text
+    field: Text
+    weight: int
+    # lowercased slot value -> category the supplier must list; empty to look up the value itself
+    requires: Mapping[Text, Text]
+    # Reason template, or one per required category; empty to leave the rule out of reasons
+    explain: Union[Text, Mapping[Text, Text]]
+
+
+class Rules(NamedTuple):
+    base_score: int
+    max_score: int
+    rules: Tuple[Rule, ...]
+    # Hash of the rules file, part of every scorer version
+    digest: Text
+
+
+class Term(NamedTuple):
+    """One slot value that a rule rewards."""
+
+    rule: int
+    # The slot value as given, for reasons
+    value: Text
+    category: Text
+    points: int
+    # Postings read in place from the catalog buffer
+    supplier_ids: Sequence[int]
+    bit: int
+
+
+class RuleHit(NamedTuple):
+    """The points one rule gave a supplier, and for which slot values."""
+
+    rule: Text
+    points: int
+    values: Tuple[Text, ...]
+    reasons: Tuple[Text, ...]
+
+
+def rules_path() -> Path:
+    configured = os.environ.get("CRO_SCORING_RULES")
+    return Path(configured) if configured else DEFAULT_RULES
+
+
+def _positive_int(spec: Mapping[Text, Any], key: Text, where: Text) -> int:
+    value = spec.get(key)
+    # Scores are kept sparse on the assumption that every rule adds points, see Scorer.add
+    if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+        raise ValueError(f"{where}: '{key}' must be a positive integer, got {value!r}")
+    return value
+
+
+def load_rules(path: Optional[Path] = None) -> Rules:
+    """Read and check a rules file."""
+    import yaml
+
+    path = Path(path or rules_path())
+    source = path.read_bytes()
+    spec = yaml.safe_load(source) or {}
+    base_score = _positive_int(spec, 'base_score', str(path))
+    max_score = _positive_int(spec, 'max_score', str(path))
+    if max_score < base_score:
+        raise ValueError(f"{path}: max_score {max_score} is below base_score {base_score}")
+
+    rules = []
+    for position, rule in enumerate(spec.get('rules') or []):
+        name = rule.get('name') or f"rule {position + 1}"
+        where = f"{path}: rule '{name}'"
+        if rule.get('slot') not in SLOTS:
+            raise ValueError(f"{where}: slot must be one of {', '.join(SLOTS)}, got {rule.get('slot')!r}")
+        if rule.get('field') not in FIELDS:
+            raise ValueError(f"{where}: field must be one of {', '.join(FIELDS)}, got {rule.get('field')!r}")
+        explain = rule.get('explain') or ""
+        if isinstance(explain, dict):
+            explain = {str(category).lower(): reason for category, reason in explain.items()}
+        rules.append(Rule(
+            name=name,
+            slot=rule['slot'],
+            field=rule['field'],
+            weight=_positive_int(rule, 'weight', where),
+            requires={str(value).lower(): str(category).lower() for value, category in (rule.get('requires') or {}).items()},
+            explain=explain,
+        ))
+    return Rules(base_score, max_score, tuple(rules), hashlib.blake2b(source, digest_size=8).hexdigest())
+
+
+class Scorer:
+    """Scoring rules compiled against one catalog."""
+
+    def __init__(self, catalog: Catalog, rules: Rules) -> None:
+        self.catalog = catalog
+        self.rules = rules.rules
+        self.base_score = rules.base_score
+        self.max_score = rules.max_score
+        self.version = f"{catalog.version}-{rules.digest}"
+        # Index of each rule's field, so a term costs one dict lookup
+        self._postings = tuple(catalog.index[rule.field] for rule in self.rules)
+        # (slot, lowercased value) -> terms, see slot_terms
+        self._slot_terms = {}
+        self.unreachable = [
+            (rule, category)
+            for rule, postings in zip(self.rules, self._postings)
+            for category in dict.fromkeys(rule.requires.values())
+            if not postings.get(category)
+        ]
+        for rule, category in self.unreachable:
+            values = sorted(value for value, required in rule.requires.items() if required == category)
+            logger.warning(
+                f"Scoring rule '{rule.name}' can never match: no supplier in catalog {catalog.version} "
+                f"lists {rule.field} '{category}', required for {rule.slot} {', '.join(values)}"
+            )
+
+    def terms(self, scope: Mapping[Text, Any]) -> List[Term]:
+        """The terms a scope scores with. Slot values may be given as typed or already lowercased."""
+        terms = []
+        for position, (rule, postings) in enumerate(zip(self.rules, self._postings)):
+            value = scope.get(rule.slot)
+            values = value if isinstance(value, (list, tuple)) else (value,)
+            for value in values:
+                if not value:
+                    continue
+                category = rule.requires.get(value.lower()) if rule.requires else value.lower()
+                supplier_ids = postings.get(category) if category is not None else None
+                if supplier_ids:
+                    terms.append(Term(
+                        position, value, category, rule.weight, supplier_ids,
+                        self.catalog.registry.bit(rule.field, category),
+                    ))
+        return terms
+
+    def slot_terms(self, slot: Text, value: Any) -> Tuple[Term, ...]:
+        """The terms of one slot value, from a cache shared by every scope ranked with this scorer.
+
+        List values are looked up item by item. Only values that some rule rewards are
+        cached, so the cache never outgrows the rules' vocabulary. Cached terms carry the
+        value as first looked up, so only use them for scores, not for reasons.
+        """
+        if isinstance(value, (list, tuple)):
+            return tuple(term for item in value for term in self.slot_terms(slot, item))
+        if not value:
+            return ()
+        key = (slot, value.lower())
+        terms = self._slot_terms.get(key)
+        if terms is None:
+            terms = tuple(self.terms({slot: value}))
+            if terms:
+                self._slot_terms[key] = terms
+        return terms
+
+    def add(self, scores: Dict[int, int], terms: Iterable[Term]) -> Dict[int, int]:
+        """Add the points of ``terms`` to ``scores``.
+
+        ``scores`` maps supplier id to score, and only holds suppliers that some term rewards.
+        """
+        base_score = self.base_score
+        get = scores.get
+        for term in terms:
+            points = term.points
+            for supplier_id in term.supplier_ids:
+                scores[supplier_id] = get(supplier_id, base_score) + points
+        return scores
+
+    def explain(self, supplier_id: int, terms: List[Term]) -> List[RuleHit]:
+        """Per-rule breakdown of the points ``terms`` give a supplier, in rule order."""
+        record = self.catalog.records[supplier_id]
+        matched = OrderedDict()
+        for term in terms:
+            if getattr(record, self.rules[term.rule].field) & term.bit:
+                matched.setdefault(term.rule, []).append(term)
+        hits = []
+        for position, rule_terms in matched.items():
+            rule = self.rules[position]
+            values = tuple(term.value for term in rule_terms)
+            if isinstance(rule.explain, dict):
+                categories = dict.fromkeys(term.category for term in rule_terms)
+                reasons = tuple(rule.explain[category] for category in categories if category in rule.explain)
+            else:
+                reasons = (rule.explain.format(values=", ".join(values)),) if rule.explain else ()
+            hits.append(RuleHit(rule.name, sum(term.points for term in rule_terms), values, reasons))
+        return hits
+
+    def total(self, hits: List[RuleHit]) -> int:
+        """The score a supplier gets from its per-rule breakdown, as ranking computes it."""
+        return min(self.base_score + sum(hit.points for hit in hits), self.max_score)
+
+
+_lock = threading.Lock()
+_rules: Optional[Rules] = None
+_scorers = OrderedDict()
+
+
+def _after_fork() -> None:
+    global _lock
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def get_scorer(catalog: Optional[Catalog] = None) -> Scorer:
+    """The scorer of the configured rules for ``catalog``, compiled on first use."""
+    global _rules
+    catalog = catalog or get_catalog()
+    scorer = _scorers.get(catalog.version)
+    if scorer is not None:
+        return scorer
+    with _lock:
+        if _rules is None:
+            _rules = load_rules()
+        scorer = _scorers.get(catalog.version)
+        if scorer is None:
+            scorer = _scorers[catalog.version] = Scorer(catalog, _rules)
+            while len(_scorers) > SCORERS_KEPT:
+                _scorers.popitem(last=False)
+        return scorer
+
+
+def main(argv: List[Text] = None) -> None:
+    parser = argparse.ArgumentParser(description="Check scoring rules against the supplier catalog and the form vocabulary.")
+    parser.add_argument("rules", nargs="?", help=f"rules file, {DEFAULT_RULES} by default")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+    from actions.vocabulary import VALIDATION
+
+    rules = load_rules(args.rules)
+    scorer = Scorer(get_catalog(), rules)
+    print(f"Rules {rules.digest}: base score {rules.base_score}, max score {rules.max_score}, catalog {scorer.catalog.version}")
+    for rule in rules.rules:
+        if rule.requires:
+            print(f"\n{rule.name}: +{rule.weight} per {rule.slot} value whose required category is listed in {rule.field}")
+        else:
+            print(f"\n{rule.name}: +{rule.weight} per {rule.slot} value listed in {rule.field}")
+        for unreachable_rule, category in scorer.unreachable:
+            if unreachable_rule is rule:
+                print(f"  never matches: no supplier lists {rule.field} '{category}'")
+        choices = VALIDATION.slots[rule.slot].choices if rule.slot in VALIDATION.slots else ()
+        unscored = [choice for choice in choices if not scorer.terms({rule.slot: choice})]
+        if unscored:
+            print(f"  scores nothing for: {', '.join(unscored)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Pre-forking launch mode for the action server::
+
+    python -m actions.server --workers 4 --port 5055
+
+The parent process imports the actions, loads the supplier catalog and binds the port.
+It then forks ``--workers`` processes that all accept connections on that socket. The
+workers share the parent's catalog: its supplier names, postings and bitsets are read in
+place from the memory-mapped catalog file, so they stay in shared page cache however often
+workers touch them. A hot reload maps the new file in every worker, which shares its pages
+in the same way. Only the category tables, sized by the vocabulary, are Python objects
+copied per worker (see ``actions.catalog``). A worker that exits is replaced, unless
+workers keep failing: after ``RESTARTS_PER_WORKER`` replacements per worker within
+``RESTART_WINDOW_SECONDS`` the server gives up. ``SIGTERM`` or ``SIGINT`` stops them all.
+
+Every worker gets an index in ``CRO_WORKER_INDEX``. With ``CRO_METRICS_PORT`` set, worker
+``i`` serves its own metrics on that port plus ``i`` (see ``actions.metrics``).
+
+Each worker can further move full rankings off its event loop with ``CRO_MATCH_PROCESSES``
+(see ``actions.matching``).
+"""
+import argparse
+import collections
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Any, List, Text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 5055
+BACKLOG = 1024
+# A worker that dies sooner than this after starting is replaced only after a pause
+RESPAWN_DELAY_SECONDS = 1.0
+# Replacements per worker within the window after which the server stops instead
+RESTARTS_PER_WORKER = 3
+RESTART_WINDOW_SECONDS = 60.0
+# Set in each worker to its index, 0 to ``--workers`` - 1
+WORKER_INDEX_ENV = "CRO_WORKER_INDEX"
+
+
+def bind(host: Text, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def spawn(app: Any, sock: socket.socket, index: int) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+    # Tells per-worker resources apart, such as the metrics port; a replacement keeps the index
+    os.environ[WORKER_INDEX_ENV] = str(index)
+    from actions.metrics import start_metrics_server
+
+    # Serve metrics from the start, not only after the worker's first action
+    start_metrics_server()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    status = 1
+    try:
+        # One Sanic server per worker process, all on the inherited socket. Only arguments
+        # of Sanic 21.12, the version rasa-sdk 3.6 pins, may be passed here.
+        app.run(sock=sock, access_log=False, motd=False)
+        status = 0
+    except Exception:
+        logger.exception(f"Action server worker {os.getpid()} failed")
+    finally:
+        os._exit(status)
+
+
+def main(argv: List[Text] = None) -> None:
+    parser = argparse.ArgumentParser(description="Run the action server with several pre-forked worker processes.")
+    parser.add_argument("--actions", default="actions", help="package of the custom actions")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(name)s %(levelname)s %(message)s")
+    from rasa_sdk.endpoint import create_app
+
+    from actions.catalog import get_catalog
+
+    app = create_app(args.actions)
+    catalog = get_catalog()
+    sock = bind(args.host, args.port)
+    # Keep the garbage collector from touching, and so copying, the parent's objects in every worker.
+    # Reference counting still copies the pages of objects a worker uses, but the catalog's
+    # postings and bitsets live in the mapped file, not in objects.
+    gc.freeze()
+    logger.info(f"Starting {args.workers} action server workers on {args.host}:{args.port} with {len(catalog)} suppliers")
+
+    # pid -> (worker index, when it started)
+    workers = {spawn(app, sock, index): (index, time.monotonic()) for index in range(args.workers)}
+    stopping = False
+    exit_status = 0
+    # When recent replacements were started
+    restarts = collections.deque()
+
+    def stop(signum: int, frame: Any) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while workers:
+        pid, status = os.wait()
+        worker = workers.pop(pid, None)
+        if stopping or worker is None:
+            continue
+        index, started = worker
+        now = time.monotonic()
+        while restarts and now - restarts[0] > RESTART_WINDOW_SECONDS:
+            restarts.popleft()
+        if len(restarts) >= RESTARTS_PER_WORKER * args.workers:
+            logger.error(
+                f"Action server worker {pid} exited with status {status} after {len(restarts)} replacements "
+                f"in {RESTART_WINDOW_SECONDS:.0f}s, stopping the server"
+            )
+            exit_status = 1
+            stop(signal.SIGTERM, None)
+            continue
+        logger.warning(f"Action server worker {pid} exited with status {status}, starting a replacement")
+        if now - started < RESPAWN_DELAY_SECONDS:
+            time.sleep(RESPAWN_DELAY_SECONDS)
+        restarts.append(time.monotonic())
+        workers[spawn(app, sock, index)] = (index, time.monotonic())
+    sys.exit(exit_status)
+
+
+if __name__ == "__main__":
+    main()
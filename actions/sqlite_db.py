@@ -0,0 +1,28 @@
+"""Local SQLite files shared by the worker processes of the action server."""
+import os
+import sqlite3
+from typing import Iterable, Optional, Text
+
+
+class ProcessConnection:
+    """A connection to the SQLite file at ``path``, opened lazily once per process.
+
+    Connections must not be shared across fork, so each worker process opens its own.
+    It runs in autocommit mode with WAL journaling, and executes ``setup`` (pragmas and
+    schema statements) when it is opened. Callers serialize their use across threads.
+    """
+
+    def __init__(self, path: Text, setup: Iterable[Text]) -> None:
+        self.path = path
+        self.setup = tuple(setup)
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    def get(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            for statement in self.setup:
+                self._connection.execute(statement)
+            self._pid = os.getpid()
+        return self._connection
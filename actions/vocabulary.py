@@ -0,0 +1,272 @@
+"""Validation tables for ``project_scope_form``, built once at startup.
+
+Values come from ``catalog/vocabulary.yml``. Its slot names are checked against the
+form in ``domain.yml``, so the two files cannot drift apart silently. Lookups are
+frozenset membership tests, and rejection messages are rendered ahead of time, so
+validation cost does not grow with the size of a vocabulary.
+
+Noisy input such as "ph 2", "oncolgy" or "Data Mgmt" is mapped to the canonical
+choice by ``resolve``: first through the synonym table, then through a trigram index.
+A fuzzy match is only accepted within ``max_edits`` of a known term, and only if every
+term of another choice is further away, so a different word such as "hematology" is
+rejected rather than read as "Dermatology". Recent resolutions are cached.
+
+``python -m actions.catalog build`` also pickles the tables to ``catalog/vocabulary.snapshot``,
+tagged with a hash of ``vocabulary.yml``, ``domain.yml`` and this module's source, which
+defines the pickled classes and how the tables are built. At startup the tables are
+loaded from the snapshot, and only parsed from YAML when the snapshot is missing or stale.
+"""
+import copyreg
+import hashlib
+import io
+import logging
+import pickle
+import re
+from functools import lru_cache
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, Mapping, NamedTuple, Optional, Pattern, Text, Tuple
+
+from actions.catalog import _replace_file
+
+logger = logging.getLogger(__name__)
+
+VOCABULARY_PATH = Path(__file__).resolve().parent.parent / "catalog" / "vocabulary.yml"
+DOMAIN_PATH = Path(__file__).resolve().parent.parent / "domain.yml"
+SNAPSHOT_PATH = VOCABULARY_PATH.with_suffix(".snapshot")
+SNAPSHOT_FORMAT = 2
+FORM_NAME = "project_scope_form"
+
+CLARIFY = "I don't understand what you are saying. Please clarify."
+
+# Terms shorter than this only match exactly
+MIN_FUZZY_LENGTH = 5
+# Terms this long may be two edits away instead of one
+TWO_EDIT_LENGTH = 12
+RESOLVE_CACHE_SIZE = 4096
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(value: Text) -> Text:
+    """Lowercase ``value`` and collapse punctuation and whitespace runs to single spaces."""
+    return _NON_ALNUM.sub(" ", value.lower()).strip()
+
+
+def _trigrams(term: Text) -> FrozenSet[Text]:
+    padded = f"  {term} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def max_edits(term: Text) -> int:
+    """Edits a misspelling of ``term`` may be away from it, growing with its length."""
+    if len(term) < MIN_FUZZY_LENGTH:
+        return 0
+    return 1 if len(term) < TWO_EDIT_LENGTH else 2
+
+
+def edit_distance(a: Text, b: Text, limit: int) -> int:
+    """Edit distance counting adjacent transpositions as one edit, or ``limit + 1`` if it exceeds ``limit``."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+    return min(current[len(b)], limit + 1)
+
+
+class TrigramIndex:
+    """Fuzzy lookup of normalized terms, each mapped to a canonical value."""
+
+    def __init__(self, terms: Mapping[Text, Text]) -> None:
+        self.terms = list(terms)
+        self.canonical = list(terms.values())
+        self.postings = {}
+        for term_id, term in enumerate(self.terms):
+            for gram in _trigrams(term):
+                self.postings.setdefault(gram, []).append(term_id)
+
+    def lookup(self, term: Text) -> Optional[Text]:
+        """Return the canonical value of the one choice ``term`` is a close misspelling of, or ``None``.
+
+        Terms sharing a trigram with ``term`` are candidates. The closest must be within
+        ``max_edits`` of it, and strictly closer than any term of another choice.
+        """
+        candidates = set()
+        for gram in _trigrams(term):
+            candidates.update(self.postings.get(gram, ()))
+        best, best_distance, runner_up = None, None, None
+        for term_id in candidates:
+            limit = max_edits(self.terms[term_id])
+            distance = edit_distance(term, self.terms[term_id], limit + 2)
+            canonical = self.canonical[term_id]
+            if best_distance is None or distance < best_distance:
+                if best is not None and best != canonical:
+                    runner_up = best_distance if runner_up is None else min(runner_up, best_distance)
+                best, best_distance, best_limit = canonical, distance, limit
+            elif canonical != best:
+                runner_up = distance if runner_up is None else min(runner_up, distance)
+        if best is None or best_distance > best_limit:
+            return None
+        if runner_up is not None and runner_up <= best_distance:
+            return None
+        return best
+
+
+class SlotVocabulary(NamedTuple):
+    slot: Text
+    choices: Tuple[Text, ...]
+    accepted: FrozenSet[Text]
+    reject_message: Text
+    # normalized choice, alias or synonym -> choice
+    synonyms: Mapping[Text, Text]
+    fuzzy: Optional[TrigramIndex]
+
+
+class TimelineFormat(NamedTuple):
+    pattern: Pattern
+    reject_message: Text
+    # abbreviated unit -> full singular unit
+    units: Mapping[Text, Text]
+
+
+class ValidationRegistry(NamedTuple):
+    slots: Mapping[Text, SlotVocabulary]
+    timeline: TimelineFormat
+
+    def accepts(self, slot: Text, value: Text) -> bool:
+        return value.strip().lower() in self.slots[slot].accepted
+
+
+def _bullets(values: Tuple[Text, ...]) -> Text:
+    return "\n".join(f"• {value}" for value in values)
+
+
+def _form_slots(domain_path: Path) -> Optional[FrozenSet[Text]]:
+    # The action server may be deployed without the domain, in which case there is nothing to check
+    if not domain_path.exists():
+        return None
+    import yaml
+
+    with open(domain_path, encoding="utf-8") as f:
+        domain = yaml.safe_load(f) or {}
+    return frozenset(domain.get("forms", {}).get(FORM_NAME, {}).get("required_slots", []))
+
+
+def build_registry(vocabulary_path: Path = VOCABULARY_PATH, domain_path: Path = DOMAIN_PATH) -> ValidationRegistry:
+    import yaml
+
+    with open(vocabulary_path, encoding="utf-8") as f:
+        vocabulary = yaml.safe_load(f) or {}
+
+    form_slots = _form_slots(domain_path)
+    if form_slots is not None and form_slots != frozenset(vocabulary):
+        raise ValueError(
+            f"{vocabulary_path} defines slots {sorted(vocabulary)} but {FORM_NAME} in {domain_path} "
+            f"requires {sorted(form_slots)}"
+        )
+
+    timeline = vocabulary.pop("timeline")
+    slots = {}
+    for slot, spec in vocabulary.items():
+        choices = tuple(spec["choices"])
+        synonyms = {normalize(choice): choice for choice in choices}
+        for choice, terms in (spec.get("synonyms") or {}).items():
+            if choice not in choices:
+                raise ValueError(f"Synonyms for unknown {slot} choice '{choice}' in {vocabulary_path}")
+            synonyms.update((normalize(term), choice) for term in terms)
+        slots[slot] = SlotVocabulary(
+            slot=slot,
+            choices=choices,
+            accepted=frozenset(value.strip().lower() for value in choices + tuple(spec.get("aliases") or ())),
+            reject_message=f"{CLARIFY} Here are the valid {spec['label']} you can choose from:\n{_bullets(choices)}",
+            synonyms=MappingProxyType(synonyms),
+            fuzzy=TrigramIndex(synonyms) if spec.get("fuzzy", True) else None,
+        )
+    return ValidationRegistry(
+        slots=MappingProxyType(slots),
+        timeline=TimelineFormat(
+            pattern=re.compile(timeline["pattern"]),
+            reject_message=(
+                f"{CLARIFY} Please provide the timeline in a format like one of these examples:\n"
+                f"{_bullets(tuple(timeline['examples']))}"
+            ),
+            units=MappingProxyType({
+                abbreviation: unit
+                for unit, abbreviations in (timeline.get("unit_synonyms") or {}).items()
+                for abbreviation in abbreviations
+            }),
+        ),
+    )
+
+
+def _sources_version(vocabulary_path: Path, domain_path: Path) -> Text:
+    digest = hashlib.blake2b(f"{SNAPSHOT_FORMAT}".encode("utf-8"), digest_size=16)
+    for path in (vocabulary_path, domain_path, Path(__file__)):
+        if path.exists():
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def _read_only(mapping: Dict[Any, Any]) -> Mapping[Any, Any]:
+    return MappingProxyType(mapping)
+
+
+def write_snapshot(path: Path = SNAPSHOT_PATH, vocabulary_path: Path = VOCABULARY_PATH, domain_path: Path = DOMAIN_PATH) -> None:
+    """Build the validation tables and pickle them to ``path``, atomically replacing any previous snapshot."""
+    registry = build_registry(vocabulary_path, domain_path)
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL)
+    # MappingProxyType cannot be pickled directly, so it is stored as a plain dict and wrapped again on load
+    pickler.dispatch_table = {**copyreg.dispatch_table, MappingProxyType: lambda mapping: (_read_only, (dict(mapping),))}
+    pickler.dump((_sources_version(vocabulary_path, domain_path), registry))
+    _replace_file(Path(path), buffer.getvalue())
+
+
+def load_registry(path: Path = SNAPSHOT_PATH, vocabulary_path: Path = VOCABULARY_PATH, domain_path: Path = DOMAIN_PATH) -> ValidationRegistry:
+    """Load the validation tables from their snapshot, or build them if it is missing or stale."""
+    try:
+        with open(path, "rb") as f:
+            version, registry = pickle.load(f)
+        if version == _sources_version(vocabulary_path, domain_path):
+            return registry
+        logger.info(f"{path} is out of date, building the validation tables from {vocabulary_path}")
+    except FileNotFoundError:
+        pass
+    except Exception:
+        logger.warning(f"Could not read {path}, building the validation tables from {vocabulary_path}", exc_info=True)
+    return build_registry(vocabulary_path, domain_path)
+
+
+VALIDATION = load_registry()
+
+_TIMELINE_PARTS = re.compile(r"^(\d+)\s*([a-z]+)\.?$")
+
+
+@lru_cache(maxsize=RESOLVE_CACHE_SIZE)
+def resolve(slot: Text, value: Text) -> Optional[Text]:
+    """Map noisy input for ``slot`` to its canonical choice, or ``None`` if nothing is close enough."""
+    vocabulary = VALIDATION.slots[slot]
+    term = normalize(value)
+    if term in vocabulary.synonyms:
+        return vocabulary.synonyms[term]
+    if vocabulary.fuzzy is None or not term:
+        return None
+    return vocabulary.fuzzy.lookup(term)
+
+
+@lru_cache(maxsize=RESOLVE_CACHE_SIZE)
+def resolve_timeline(value: Text) -> Optional[Text]:
+    """Expand an abbreviated timeline such as "6 mos" to "6 months", or return ``None``."""
+    parts = _TIMELINE_PARTS.match(value.strip().lower())
+    if not parts or parts.group(2) not in VALIDATION.timeline.units:
+        return None
+    amount, unit = parts.group(1), VALIDATION.timeline.units[parts.group(2)]
+    return f"{amount} {unit}" if int(amount) == 1 else f"{amount} {unit}s"
@@ -0,0 +1,117 @@
+"""Measure CRO ranking quality against the CROs users actually selected.
+
+Reads the conversations in the SQLite tracker store and pairs the project scope shown
+by every ``action_match_cros`` call with the ``cro_name`` the user picked afterwards.
+Each scope is ranked again against the current catalog with one or more scoring rules
+files, and the chosen CRO's rank is scored::
+
+    python -m addons.evaluate_ranking trackers.db
+    python -m addons.evaluate_ranking trackers.db --rules catalog/scoring.yml candidate.yml
+
+Per rules file it reports hit@1 and hit@k (the chosen CRO was ranked first, or among
+the ``--top-k`` shown), the mean reciprocal rank and the mean rank. Per rule, it
+reports how often the rule gave the chosen CRO points. Selections of a CRO that is
+not in the catalog are counted but not ranked.
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Text, Tuple
+
+from actions.catalog import get_catalog, load_catalog
+from actions.matching import TOP_MATCHES
+from actions.scoring import SLOTS, Scorer, load_rules, rules_path
+from addons.replay import iter_conversations
+
+
+def selections(events: List[Dict[Text, Any]]) -> Iterator[Tuple[Dict[Text, Any], Text]]:
+    """Yield ``(scope, cro name)`` for every CRO chosen after ``action_match_cros`` showed matches."""
+    slots = {}
+    shown = None
+    for event in events:
+        kind = event.get("event")
+        if kind == "action" and event.get("name") == "action_match_cros":
+            shown = {slot: slots.get(slot) for slot in SLOTS}
+        elif kind == "slot":
+            slots[event.get("name")] = event.get("value")
+            if event.get("name") == "cro_name" and event.get("value") and shown is not None:
+                yield shown, event["value"]
+                shown = None
+        elif kind in ("restart", "session_started", "reset_slots"):
+            # Slots carried over into a new session are stored as slot events right after it
+            slots = {}
+            if kind != "session_started":
+                shown = None
+
+
+def rank_of(scorer: Scorer, scope: Dict[Text, Any], supplier_id: int) -> int:
+    """1-based position of a supplier in the full ranking of ``scope``, ties broken by catalog order."""
+    scores = scorer.add({}, scorer.terms(scope))
+    if supplier_id not in scores:
+        # Everyone with points ranks ahead, then the suppliers at the base score in catalog order
+        return 1 + len(scores) + supplier_id - sum(1 for other in scores if other < supplier_id)
+    key = (min(scores[supplier_id], scorer.max_score), -supplier_id)
+    return 1 + sum(1 for other, score in scores.items() if (min(score, scorer.max_score), -other) > key)
+
+
+def evaluate(scorer: Scorer, chosen: Iterable[Tuple[Dict[Text, Any], Text]], k: int) -> Dict[Text, Any]:
+    supplier_ids = {name.lower(): supplier_id for supplier_id, name in enumerate(scorer.catalog.suppliers)}
+    ranks = []
+    unknown = 0
+    rule_hits = dict.fromkeys((rule.name for rule in scorer.rules), 0)
+    for scope, cro_name in chosen:
+        supplier_id = supplier_ids.get(cro_name.strip().lower())
+        if supplier_id is None:
+            unknown += 1
+            continue
+        ranks.append(rank_of(scorer, scope, supplier_id))
+        for hit in scorer.explain(supplier_id, scorer.terms(scope)):
+            rule_hits[hit.rule] += 1
+    ranked = len(ranks) or 1
+    return {
+        "selections": len(ranks) + unknown,
+        "unknown": unknown,
+        "hit@1": round(sum(rank == 1 for rank in ranks) / ranked, 4),
+        f"hit@{k}": round(sum(rank <= k for rank in ranks) / ranked, 4),
+        "mrr": round(sum(1 / rank for rank in ranks) / ranked, 4),
+        "mean_rank": round(sum(ranks) / ranked, 2),
+        "rule_hit_rate": {rule: round(count / ranked, 4) for rule, count in rule_hits.items()},
+    }
+
+
+def main(argv: Optional[List[Text]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Evaluate CRO rankings against the CROs selected in stored conversations.")
+    parser.add_argument("store", help="SQLite database of the tracker store")
+    parser.add_argument("--rules", nargs="+", default=[str(rules_path())], help="scoring rules files to compare")
+    parser.add_argument("--catalog", help="supplier catalog to rank, the configured one by default")
+    parser.add_argument("--top-k", type=int, default=TOP_MATCHES, help="matches shown to the user")
+    parser.add_argument("--since", type=float, help="only conversations with events after this UNIX timestamp")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON lines")
+    args = parser.parse_args(argv)
+
+    catalog = load_catalog(Path(args.catalog)) if args.catalog else get_catalog()
+    chosen = [selection for _, events in iter_conversations(args.store, args.since) for selection in selections(events)]
+    results = []
+    for path in args.rules:
+        result = {"rules": path, **evaluate(Scorer(catalog, load_rules(Path(path))), chosen, args.top_k)}
+        results.append(result)
+        if args.json:
+            print(json.dumps(result))
+    if args.json:
+        return
+
+    print(f"{len(chosen)} selections, catalog {catalog.version} ({len(catalog)} suppliers)")
+    print(f"{'rules':<32} {'hit@1':>7} {f'hit@{args.top_k}':>7} {'MRR':>7} {'rank':>7} {'unknown':>8}")
+    for result in results:
+        print(
+            f"{result['rules']:<32} {result['hit@1']:>7} {result[f'hit@{args.top_k}']:>7} "
+            f"{result['mrr']:>7} {result['mean_rank']:>7} {result['unknown']:>8}"
+        )
+    for result in results:
+        print(f"\nRule hit rate on the chosen CROs, {result['rules']}:")
+        for rule, rate in result["rule_hit_rate"].items():
+            print(f"  {rule:<30} {rate:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""Replay conversations from the SQLite tracker store through the custom actions.
+
+Streams the stored conversations in sender order and re-runs every custom action
+call they contain in parallel worker processes, each with its own ``ActionExecutor``.
+Every call gets the tracker state it had when it ran in production::
+
+    python -m addons.replay trackers.db --output replay.jsonl --workers 4
+    python -m addons.replay trackers.db --action action_match_cros --compare replay.jsonl
+
+The output is one JSON line per call with the responses and events the action
+returned. ``--compare`` reports calls whose responses differ from an earlier run, for
+example the ``action_match_cros`` rankings after a catalog or scoring change. Form
+validation is replayed with the slot values extracted from the user's latest message,
+which Rasa appends to the tracker events as the candidates to validate.
+Delivery to CROs and the metrics server are disabled in the workers. Projects sent
+during the replay go to a temporary outbox.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Text, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Events that carry no state for the actions
+SKIPPED_EVENTS = {"bot", "action_execution_rejected"}
+
+
+def iter_conversations(path: Text, since: Optional[float] = None) -> Iterator[Tuple[Text, List[Dict[Text, Any]]]]:
+    """Yield ``(sender id, events)`` per conversation without loading the whole store."""
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    if since is None:
+        rows = connection.execute("SELECT sender_id, data FROM events ORDER BY sender_id, id")
+    else:
+        rows = connection.execute(
+            "SELECT sender_id, data FROM events WHERE sender_id IN "
+            "(SELECT DISTINCT sender_id FROM events WHERE timestamp >= ?) ORDER BY sender_id, id",
+            (since,),
+        )
+    try:
+        for sender_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+            yield sender_id, [json.loads(data) for _, data in group]
+    finally:
+        connection.close()
+
+
+def action_calls(sender_id: Text, events: List[Dict[Text, Any]], actions: Any, domain: Dict[Text, Any]) -> Iterator[Tuple[int, Text, Dict[Text, Any]]]:
+    """Yield ``(event index, action name, webhook payload)`` for every custom action call."""
+    slots = {}
+    # Slots extracted from the latest user message, which the form validates next
+    candidates = {}
+    active_loop = {}
+    latest_message = {}
+    latest_action_name = None
+    for position, event in enumerate(events):
+        kind = event.get("event")
+        if kind == "action":
+            name = event.get("name")
+            validation = f"validate_{name}"
+            call_events = None
+            if name in actions:
+                call_events = events[:position]
+            elif validation in actions:
+                # FormValidationAction only validates the slot events at the end of the tracker
+                call_events = events[:position] + [
+                    {"event": "slot", "name": slot, "value": value} for slot, value in candidates.items()
+                ]
+                candidates = {}
+                name = validation
+            if call_events is not None:
+                yield position, name, {
+                    "next_action": name,
+                    "sender_id": sender_id,
+                    "tracker": {
+                        "sender_id": sender_id,
+                        "slots": dict(slots),
+                        "latest_message": latest_message,
+                        "events": call_events,
+                        "paused": False,
+                        "followup_action": None,
+                        "active_loop": active_loop,
+                        "latest_action_name": latest_action_name,
+                    },
+                    "domain": domain,
+                    "version": "3.6.2",
+                }
+            latest_action_name = event.get("name")
+        elif kind == "slot":
+            slots[event.get("name")] = event.get("value")
+            if latest_action_name == "action_extract_slots":
+                candidates[event.get("name")] = event.get("value")
+        elif kind == "user":
+            latest_message = dict(event.get("parse_data") or {}, text=event.get("text"))
+            candidates = {}
+        elif kind == "active_loop":
+            active_loop = {"name": event["name"]} if event.get("name") else {}
+        elif kind in ("restart", "session_started"):
+            # Slots carried over into a new session are stored as slot events right after it
+            slots = {}
+            candidates = {}
+            active_loop = {}
+        elif kind == "reset_slots":
+            slots = {}
+            candidates = {}
+
+
+_executor = None
+_loop = None
+_domain = None
+
+
+def _init_worker(actions_package: Text) -> None:
+    import yaml
+    from rasa_sdk.executor import ActionExecutor
+
+    global _executor, _loop, _domain
+    _executor = ActionExecutor()
+    _executor.register_package(actions_package)
+    _loop = asyncio.new_event_loop()
+    with open(ROOT / "domain.yml", encoding="utf-8") as f:
+        _domain = yaml.safe_load(f)
+
+
+def _replay(conversation: Tuple[Text, List[Dict[Text, Any]], Optional[Text]]) -> List[Dict[Text, Any]]:
+    sender_id, events, only = conversation
+    results = []
+    for position, name, payload in action_calls(sender_id, events, _executor.actions, _domain):
+        if only and name != only:
+            continue
+        result = {"sender_id": sender_id, "event": position, "action": name}
+        started = time.perf_counter()
+        try:
+            response = _loop.run_until_complete(_executor.run(payload)) or {}
+            result["responses"] = [message.get("text") for message in response.get("responses", [])]
+            result["events"] = response.get("events", [])
+        except Exception as e:
+            result["error"] = repr(e)
+        result["seconds"] = round(time.perf_counter() - started, 6)
+        results.append(result)
+    return results
+
+
+def _call_key(result: Dict[Text, Any]) -> Tuple[Text, int, Text]:
+    return result["sender_id"], result["event"], result["action"]
+
+
+def load_results(path: Text) -> Dict[Tuple[Text, int, Text], Dict[Text, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return {_call_key(result): result for result in map(json.loads, f)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay stored conversations through the custom actions.")
+    parser.add_argument("store", help="SQLite database of the tracker store")
+    parser.add_argument("--output", help="write one JSON line per replayed call")
+    parser.add_argument("--compare", help="report calls whose responses differ from this earlier output")
+    parser.add_argument("--action", help="only replay calls of this action")
+    parser.add_argument("--since", type=float, help="only conversations with events after this UNIX timestamp")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--actions-package", default="actions")
+    args = parser.parse_args()
+
+    baseline = load_results(args.compare) if args.compare else None
+    output = open(args.output, "w", encoding="utf-8") if args.output else None
+
+    # Keep the replay away from production side effects
+    outbox = tempfile.NamedTemporaryFile(prefix="replay-outbox-", suffix=".db", delete=False)
+    os.environ["CRO_OUTBOX_PATH"] = outbox.name
+    os.environ.pop("CRO_DELIVERY_URL", None)
+    os.environ.pop("CRO_METRICS_PORT", None)
+    sys.path.insert(0, str(ROOT))
+
+    calls = Counter()
+    errors = Counter()
+    changed = []
+    started = time.perf_counter()
+    conversations = ((sender_id, events, args.action) for sender_id, events in iter_conversations(args.store, args.since))
+    try:
+        with Pool(args.workers, initializer=_init_worker, initargs=(args.actions_package,)) as pool:
+            for results in pool.imap(_replay, conversations, chunksize=16):
+                for result in results:
+                    calls[result["action"]] += 1
+                    if "error" in result:
+                        errors[result["action"]] += 1
+                    if output:
+                        output.write(json.dumps(result) + "\n")
+                    if baseline is not None:
+                        previous = baseline.get(_call_key(result))
+                        if previous is not None and previous.get("responses") != result.get("responses"):
+                            changed.append((previous, result))
+    finally:
+        if output:
+            output.close()
+        os.unlink(outbox.name)
+    elapsed = time.perf_counter() - started
+
+    total = sum(calls.values())
+    print(f"Replayed {total} calls in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} calls/s)")
+    for action, count in sorted(calls.items()):
+        print(f"  {action}: {count} calls, {errors[action]} errors")
+    if baseline is not None:
+        print(f"{len(changed)} calls responded differently from {args.compare}")
+        for previous, result in changed[:10]:
+            print(f"--- {result['sender_id']} event {result['event']} {result['action']}")
+            print(f"before: {previous.get('responses')}")
+            print(f"after:  {result.get('responses')}")
+        if changed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""SQLite tracker store for the Rasa server.
+
+Keeps every conversation event in a local SQLite database in WAL mode, so a restart
+resumes half-filled forms. Enable it in ``endpoints.yml``::
+
+    tracker_store:
+      type: addons.sqlite_tracker_store.SQLiteTrackerStore
+      db: trackers.db
+
+Events are stored one row each, indexed on sender id and timestamp. Concurrent saves
+are committed together: while one batch is written, the events of every other save
+queue up and go into the next transaction with a single ``executemany``. A save
+returns once its events are committed.
+
+``python -m addons.replay`` replays the stored conversations through the custom actions.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Text, Tuple
+
+from rasa.core.brokers.broker import EventBroker
+from rasa.core.tracker_store import TrackerStore
+from rasa.shared.core.domain import Domain
+from rasa.shared.core.events import SessionStarted
+from rasa.shared.core.trackers import DialogueStateTracker
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS events ("
+    "id INTEGER PRIMARY KEY, sender_id TEXT NOT NULL, type_name TEXT NOT NULL, timestamp REAL, "
+    "intent_name TEXT, action_name TEXT, data TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS events_sender ON events (sender_id, id)",
+    "CREATE INDEX IF NOT EXISTS events_timestamp ON events (timestamp)",
+)
+
+# Events of a conversation's current session: everything from its last session start on
+SESSION_EVENTS = (
+    "FROM events WHERE sender_id = ? AND id >= COALESCE("
+    f"(SELECT MAX(id) FROM events WHERE sender_id = ? AND type_name = '{SessionStarted.type_name}'), 0)"
+)
+
+
+def connect(path: Text) -> sqlite3.Connection:
+    """Open the event database, creating its schema if needed."""
+    connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    for statement in SCHEMA:
+        connection.execute(statement)
+    return connection
+
+
+def event_row(sender_id: Text, event: Dict[Text, Any]) -> Tuple[Any, ...]:
+    return (
+        sender_id,
+        event["event"],
+        event.get("timestamp"),
+        (event.get("parse_data") or {}).get("intent", {}).get("name"),
+        event.get("name") if event["event"] == "action" else None,
+        json.dumps(event),
+    )
+
+
+class SQLiteTrackerStore(TrackerStore):
+    """Stores conversation events in a local SQLite database."""
+
+    def __init__(
+        self,
+        domain: Optional[Domain] = None,
+        db: Text = "trackers.db",
+        event_broker: Optional[EventBroker] = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(domain, event_broker, **kwargs)
+        self.path = db
+        self._reader_connection = None
+        self._writer_connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # Saves waiting for the next commit: (rows, future resolved once they are committed)
+        self._pending: List[Tuple[List[Tuple[Any, ...]], asyncio.Future]] = []
+        self._flush_task = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tracker-store")
+
+    def _connections(self) -> Tuple[sqlite3.Connection, sqlite3.Connection]:
+        # Connections must not be shared across fork, so each process opens its own.
+        # Reads run on the event loop and writes on the writer thread, each with its own connection.
+        with self._lock:
+            if self._pid != os.getpid():
+                self._writer_connection = connect(self.path)
+                self._reader_connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                self._pid = os.getpid()
+            return self._reader_connection, self._writer_connection
+
+    async def save(self, tracker: DialogueStateTracker) -> None:
+        await self.stream_events(tracker)
+        reader, _ = self._connections()
+        existing = reader.execute(f"SELECT COUNT(*) {SESSION_EVENTS}", (tracker.sender_id, tracker.sender_id)).fetchone()[0]
+        rows = [event_row(tracker.sender_id, event.as_dict()) for event in list(tracker.events)[existing:]]
+        if not rows:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((rows, future))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush())
+        await future
+
+    async def _flush(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            batch, self._pending = self._pending, []
+            try:
+                await loop.run_in_executor(self._executor, self._insert, [row for rows, _ in batch for row in rows])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for _, future in batch:
+                    future.set_result(None)
+
+    def _insert(self, rows: List[Tuple[Any, ...]]) -> None:
+        _, writer = self._connections()
+        writer.execute("BEGIN")
+        try:
+            writer.executemany(
+                "INSERT INTO events (sender_id, type_name, timestamp, intent_name, action_name, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        except Exception:
+            writer.execute("ROLLBACK")
+            raise
+        writer.execute("COMMIT")
+
+    async def retrieve(self, sender_id: Text) -> Optional[DialogueStateTracker]:
+        reader, _ = self._connections()
+        rows = reader.execute(f"SELECT data {SESSION_EVENTS} ORDER BY id", (sender_id, sender_id)).fetchall()
+        return self._tracker(sender_id, rows)
+
+    async def retrieve_full_tracker(self, sender_id: Text) -> Optional[DialogueStateTracker]:
+        reader, _ = self._connections()
+        rows = reader.execute("SELECT data FROM events WHERE sender_id = ? ORDER BY id", (sender_id,)).fetchall()
+        return self._tracker(sender_id, rows)
+
+    def _tracker(self, sender_id: Text, rows: List[Tuple[Text]]) -> Optional[DialogueStateTracker]:
+        if not rows:
+            logger.debug(f"Can't retrieve tracker matching sender id '{sender_id}' from SQLite storage")
+            return None
+        return DialogueStateTracker.from_dict(sender_id, [json.loads(data) for data, in rows], self.domain.slots)
+
+    async def keys(self) -> Iterable[Text]:
+        reader, _ = self._connections()
+        return [sender_id for sender_id, in reader.execute("SELECT DISTINCT sender_id FROM events")]
@@ -0,0 +1,359 @@
+"""Latency and throughput benchmark for the custom action webhook.
+
+Builds synthetic tracker payloads for ``action_match_cros``,
+``action_output_project_scope`` and ``validate_project_scope_form`` against
+synthetic supplier catalogs of increasing size. It then runs them either in-process
+through ``rasa_sdk``'s ``ActionExecutor`` or over HTTP against a locally started
+action server with concurrent clients::
+
+    python benchmarks/bench_actions.py --mode inprocess --sizes 15 1000 50000
+    python benchmarks/bench_actions.py --mode server --concurrency 32 --save-baseline benchmarks/baseline.json
+    python benchmarks/bench_actions.py --compare benchmarks/baseline.json
+
+It reports p50/p95/p99 latency, throughput and peak RSS for each
+(mode, action, catalog size). A saved baseline makes regressions between commits visible.
+
+``--mode startup`` measures cold start instead: the time from launching a fresh action
+server to its first successful ``/webhook`` response, over ``--startup-runs`` launches::
+
+    python benchmarks/bench_actions.py --mode startup --sizes 15 50000 --workers 0
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Text, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+ACTIONS = ("action_match_cros", "action_output_project_scope", "validate_project_scope_form")
+DEFAULT_SIZES = (15, 1000, 10000, 50000)
+REGRESSION_TOLERANCE = 0.2
+
+SPECIALTIES = ["preclinical", "clinical trials", "pediatric", "geriatric", "regulatory affairs", "biostatistics",
+               "patient recruitment", "site management", "bioanalytical", "toxicology", "medical writing"]
+
+
+def synthetic_suppliers(size: int, seed: int = 0) -> List[Dict[Text, Any]]:
+    """Generate ``size`` suppliers drawing expertise from the validation vocabulary."""
+    from actions.vocabulary import VALIDATION
+
+    rng = random.Random(seed)
+    areas = [area.lower() for area in VALIDATION.slots["therapeutic_area"].choices] + ["rare diseases", "infectious diseases"]
+    services = [service.lower() for service in VALIDATION.slots["services_needed"].choices]
+    return [
+        {
+            "name": f"Synthetic CRO {i:05d}",
+            "specialties": rng.sample(SPECIALTIES, rng.randint(1, 4)),
+            "therapeutic_areas": rng.sample(areas, rng.randint(1, 5)),
+            "services": rng.sample(services, rng.randint(1, 5)),
+        }
+        for i in range(size)
+    ]
+
+
+def build_catalog(size: int, directory: Path) -> Path:
+    """Write the real catalog (size 15) or a synthetic one of ``size`` suppliers to ``directory``."""
+    from actions.catalog import DEFAULT_SOURCE, read_source, write_catalog
+
+    suppliers = read_source(DEFAULT_SOURCE)
+    if size != len(suppliers):
+        suppliers = synthetic_suppliers(size)
+    path = directory / f"suppliers-{size}.bin"
+    write_catalog(suppliers, path)
+    return path
+
+
+def load_domain() -> Dict[Text, Any]:
+    import yaml
+
+    with open(ROOT / "domain.yml", encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+
+def random_scope(rng: random.Random) -> Dict[Text, Any]:
+    from actions.vocabulary import VALIDATION
+
+    slots = VALIDATION.slots
+    return {
+        "study_phase": rng.choice(slots["study_phase"].choices),
+        "therapeutic_area": rng.choice(slots["therapeutic_area"].choices),
+        "services_needed": rng.sample(slots["services_needed"].choices, rng.randint(1, 4)),
+        "patient_population": rng.choice(slots["patient_population"].choices),
+        "timeline": rng.choice(["6 months", "1 year", "18 months", "12 weeks"]),
+    }
+
+
+def payload(action: Text, scope: Dict[Text, Any], domain: Dict[Text, Any], sender_id: Text, rng: random.Random) -> Dict[Text, Any]:
+    """Build an action server request the way Rasa sends it to ``/webhook``."""
+    slots = dict(scope)
+    events = [{"event": "action", "name": "action_listen"}, {"event": "user", "text": "", "parse_data": {}}]
+    active_loop = {}
+    latest_message = {"intent": {"name": "complete_project_scope"}, "entities": [], "text": ""}
+    if action == "validate_project_scope_form":
+        # Validate one slot the user just provided, sometimes with a typo or synonym
+        slot = rng.choice(["study_phase", "therapeutic_area", "services_needed", "patient_population", "timeline"])
+        value = scope[slot]
+        if slot == "therapeutic_area" and rng.random() < 0.5:
+            value = value[:-2] + value[-1]
+        slots = {slot: value, "requested_slot": slot}
+        events.append({"event": "slot", "name": slot, "value": value})
+        active_loop = {"name": "project_scope_form"}
+        latest_message = {"intent": {"name": f"provide_{slot}"}, "entities": [], "text": str(value)}
+    return {
+        "next_action": action,
+        "sender_id": sender_id,
+        "tracker": {
+            "sender_id": sender_id,
+            "slots": slots,
+            "latest_message": latest_message,
+            "events": events,
+            "paused": False,
+            "followup_action": None,
+            "active_loop": active_loop,
+            "latest_action_name": "action_listen",
+        },
+        "domain": domain,
+        "version": "3.6.2",
+    }
+
+
+def summarize(latencies: List[float], elapsed: float, peak_rss_kb: int) -> Dict[Text, Any]:
+    latencies = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 3)
+
+    return {
+        "requests": len(latencies),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "peak_rss_mb": round(peak_rss_kb / 1024, 1),
+    }
+
+
+async def bench_inprocess(action: Text, requests: int, domain: Dict[Text, Any]) -> Dict[Text, Any]:
+    from rasa_sdk.executor import ActionExecutor
+
+    executor = ActionExecutor()
+    executor.register_package("actions")
+    rng = random.Random(1)
+    calls = [payload(action, random_scope(rng), domain, f"bench-{i}", rng) for i in range(requests)]
+    latencies = []
+    started = time.perf_counter()
+    for call in calls:
+        t = time.perf_counter()
+        await executor.run(call)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+    return summarize(latencies, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _peak_rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+async def bench_server(action: Text, requests: int, concurrency: int, url: Text, domain: Dict[Text, Any], pid: int) -> Dict[Text, Any]:
+    import aiohttp
+
+    rng = random.Random(1)
+    calls = [json.dumps(payload(action, random_scope(rng), domain, f"bench-{i}", rng)) for i in range(requests)]
+    queue = asyncio.Queue()
+    for call in calls:
+        queue.put_nowait(call)
+    latencies = []
+
+    async def client(session: aiohttp.ClientSession) -> None:
+        while not queue.empty():
+            body = queue.get_nowait()
+            t = time.perf_counter()
+            async with session.post(url, data=body, headers={"Content-Type": "application/json"}) as response:
+                await response.read()
+                if response.status != 200:
+                    raise RuntimeError(f"{action} returned HTTP {response.status}")
+            latencies.append(time.perf_counter() - t)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, elapsed, _peak_rss_kb(pid))
+
+
+def start_server(catalog: Path, env: Dict[Text, Text], workers: int = 0) -> Tuple[subprocess.Popen, Text]:
+    """Start an action server: plain ``rasa_sdk``, or ``actions.server`` with ``workers`` pre-forked workers."""
+    port = _free_port()
+    if workers:
+        command = [sys.executable, "-m", "actions.server", "--workers", str(workers), "--port", str(port)]
+    else:
+        command = [sys.executable, "-m", "rasa_sdk", "--actions", "actions", "--port", str(port)]
+    server = subprocess.Popen(
+        command,
+        cwd=ROOT,
+        env={**os.environ, **env, "CRO_CATALOG_PATH": str(catalog)},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def bench_startup(catalog: Path, env: Dict[Text, Text], domain: Dict[Text, Any], runs: int, workers: int) -> Dict[Text, Any]:
+    """Time from starting the server process to its first successful ``action_match_cros`` call."""
+    import aiohttp
+
+    rng = random.Random(1)
+    body = json.dumps(payload("action_match_cros", random_scope(rng), domain, "startup", rng))
+    durations = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        server, url = start_server(catalog, env, workers)
+        try:
+            async with aiohttp.ClientSession() as session:
+                while True:
+                    try:
+                        async with session.post(f"{url}/webhook", data=body, headers={"Content-Type": "application/json"}) as response:
+                            if response.status == 200:
+                                break
+                    except aiohttp.ClientError:
+                        pass
+                    if time.perf_counter() - started > 120:
+                        raise RuntimeError("Action server did not answer /webhook within 120s")
+                    await asyncio.sleep(0.01)
+            durations.append(time.perf_counter() - started)
+        finally:
+            server.terminate()
+            server.wait()
+    durations.sort()
+    return {
+        "runs": runs,
+        "p50_ms": round(durations[len(durations) // 2] * 1000, 1),
+        "p95_ms": round(durations[min(len(durations) - 1, int(0.95 * len(durations)))] * 1000, 1),
+        "min_ms": round(durations[0] * 1000, 1),
+    }
+
+
+async def wait_until_healthy(url: Text, timeout: float = 60.0) -> None:
+    import aiohttp
+
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{url}/health") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"Action server at {url} did not become healthy within {timeout}s")
+
+
+async def run(args: argparse.Namespace) -> List[Dict[Text, Any]]:
+    domain = load_domain()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            catalog = build_catalog(size, Path(tmp))
+            if args.mode == "startup":
+                results.append({"mode": "startup", "action": "first_webhook", "catalog_size": size,
+                                **await bench_startup(catalog, {"CRO_MATCH_CACHE": args.match_cache}, domain, args.startup_runs, args.workers)})
+                print(json.dumps(results[-1]))
+                continue
+            if args.mode == "inprocess":
+                from actions import catalog as catalog_module
+
+                os.environ["CRO_CATALOG_PATH"] = str(catalog)
+                catalog_module.reload_catalog(force=True)
+                for action in args.actions:
+                    results.append({"mode": "inprocess", "action": action, "catalog_size": size,
+                                    **await bench_inprocess(action, args.requests, domain)})
+            else:
+                server, url = start_server(catalog, {"CRO_MATCH_CACHE": args.match_cache}, args.workers)
+                try:
+                    await wait_until_healthy(url)
+                    for action in args.actions:
+                        results.append({"mode": "server", "action": action, "catalog_size": size, "concurrency": args.concurrency,
+                                        **await bench_server(action, args.requests, args.concurrency, f"{url}/webhook", domain, server.pid)})
+                finally:
+                    server.terminate()
+                    server.wait()
+            for result in results[-len(args.actions):]:
+                print(json.dumps(result))
+    return results
+
+
+def _result_key(result: Dict[Text, Any]) -> Text:
+    return f"{result['mode']}/{result['action']}/{result['catalog_size']}"
+
+
+def compare(results: List[Dict[Text, Any]], baseline_path: Path) -> bool:
+    """Print p95 and throughput changes against a baseline. Returns ``False`` on a regression."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {_result_key(result): result for result in json.load(f)["results"]}
+    ok = True
+    for result in results:
+        before = baseline.get(_result_key(result))
+        if before is None:
+            continue
+        p95 = result["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        # Startup results have no throughput
+        throughput = result["throughput_rps"] / before["throughput_rps"] - 1 if before.get("throughput_rps") else 0.0
+        regressed = p95 > REGRESSION_TOLERANCE or throughput < -REGRESSION_TOLERANCE
+        ok = ok and not regressed
+        print(f"{'REGRESSION' if regressed else 'ok':<10} {_result_key(result):<55} p95 {p95:+.1%}  throughput {throughput:+.1%}")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the custom action webhook.")
+    parser.add_argument("--mode", choices=("inprocess", "server", "startup"), default="inprocess")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="supplier catalog sizes")
+    parser.add_argument("--actions", nargs="+", choices=ACTIONS, default=list(ACTIONS))
+    parser.add_argument("--requests", type=int, default=2000, help="requests per action and catalog size")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients in server mode")
+    parser.add_argument("--startup-runs", type=int, default=5, help="server launches per catalog size in startup mode")
+    parser.add_argument("--workers", type=int, default=0, help="pre-forked workers for server and startup modes, 0 runs plain rasa_sdk")
+    parser.add_argument("--match-cache", default="off", help="CRO_MATCH_CACHE setting, off to measure scoring")
+    parser.add_argument("--save-baseline", type=Path, help="write results to this JSON file")
+    parser.add_argument("--compare", type=Path, help="compare results to a saved baseline and fail on regressions")
+    args = parser.parse_args()
+
+    os.environ["CRO_MATCH_CACHE"] = args.match_cache
+    # Catalogs are swapped explicitly between sizes
+    os.environ["CRO_CATALOG_POLL_SECONDS"] = "0"
+    results = asyncio.run(run(args))
+
+    if args.save_baseline:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({"commit": commit, "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}, f, indent=2)
+    if args.compare and not compare(results, args.compare):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Throughput of the pre-forked action server as the number of workers grows.
+
+Starts ``python -m actions.server`` with 1, 2, 4, ... workers, up to the core count,
+against one synthetic catalog. It then drives ``action_match_cros`` with concurrent
+clients. For each worker count it reports throughput, the speedup over one worker and
+the total proportional set size (PSS) of the server processes. PSS shows how much
+memory each extra worker, with its own copy of the catalog, adds::
+
+    python benchmarks/bench_scaling.py --size 50000 --requests 4000 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Text
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.bench_actions import ACTIONS, bench_server, build_catalog, load_domain, start_server, wait_until_healthy  # noqa: E402
+
+
+def _descendants(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+    return children + [grandchild for child in children for grandchild in _descendants(child)]
+
+
+def total_pss_kb(pid: int) -> int:
+    """PSS of a process and all its descendants. Shared pages are split between the processes sharing them."""
+    total = 0
+    for process in [pid] + _descendants(pid):
+        try:
+            with open(f"/proc/{process}/smaps_rollup") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("Pss:"))
+        except (OSError, StopIteration):
+            pass
+    return total
+
+
+def default_workers() -> List[int]:
+    counts = []
+    workers = 1
+    while workers < (os.cpu_count() or 1):
+        counts.append(workers)
+        workers *= 2
+    return counts + [os.cpu_count() or 1]
+
+
+async def run(args: argparse.Namespace) -> List[Dict[Text, Any]]:
+    domain = load_domain()
+    env = {"CRO_MATCH_CACHE": args.match_cache, "CRO_MATCH_PROCESSES": str(args.match_processes)}
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        catalog = build_catalog(args.size, Path(tmp))
+        for workers in args.workers:
+            server, url = start_server(catalog, env, workers=workers)
+            try:
+                await wait_until_healthy(url)
+                result = await bench_server(args.action, args.requests, args.concurrency, f"{url}/webhook", domain, server.pid)
+                result["pss_mb"] = round(total_pss_kb(server.pid) / 1024, 1)
+            finally:
+                server.terminate()
+                server.wait()
+            result = {"workers": workers, "catalog_size": args.size, "action": args.action, **result}
+            result["speedup"] = round(result["throughput_rps"] / results[0]["throughput_rps"], 2) if results else 1.0
+            results.append(result)
+            print(json.dumps(result))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark action server throughput against the number of workers.")
+    parser.add_argument("--workers", type=int, nargs="+", default=default_workers(), help="worker counts to measure")
+    parser.add_argument("--size", type=int, default=50000, help="suppliers in the synthetic catalog")
+    parser.add_argument("--action", choices=ACTIONS, default="action_match_cros")
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=64, help="concurrent clients")
+    parser.add_argument("--match-processes", type=int, default=0, help="CRO_MATCH_PROCESSES of every worker")
+    parser.add_argument("--match-cache", default="off", help="CRO_MATCH_CACHE setting, off to measure scoring")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(f"\n{'workers':>8} {'rps':>10} {'speedup':>8} {'p95 ms':>9} {'PSS MB':>8}")
+    for result in results:
+        print(f"{result['workers']:>8} {result['throughput_rps']:>10} {result['speedup']:>8} {result['p95_ms']:>9} {result['pss_mb']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Memory and scoring time of ``Supplier`` records against the old dict-of-lists shape.
+
+Builds a synthetic catalog and measures, for both representations, the memory held
+per supplier (with ``tracemalloc``) and the time to score every supplier against a
+batch of project scopes with the rules of ``ActionMatchCROs``::
+
+    python benchmarks/bench_supplier_records.py --size 50000 --scopes 20
+"""
+import argparse
+import gc
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Text, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.bench_actions import build_catalog, random_scope  # noqa: E402
+
+
+def measure(build: Callable[[], Any]) -> Tuple[Any, int]:
+    """Build a structure and return it with the bytes it keeps allocated."""
+    gc.collect()
+    tracemalloc.start()
+    value = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size
+
+
+def score_dicts(expertise: Dict[Text, Dict[Text, List[Text]]], scorer: Any, scope: Dict[Text, Any]) -> List[int]:
+    terms = [(scorer.rules[term.rule].field, term.category, term.points) for term in scorer.terms(scope)]
+    scores = []
+    for entry in expertise.values():
+        score = scorer.base_score
+        for field, category, points in terms:
+            if category in [value.lower() for value in entry[field]]:
+                score += points
+        scores.append(score)
+    return scores
+
+
+def score_records(records: List[Any], scorer: Any, scope: Dict[Text, Any]) -> List[int]:
+    terms = [(scorer.rules[term.rule].field, term.bit, term.points) for term in scorer.terms(scope)]
+    scores = []
+    for record in records:
+        score = scorer.base_score
+        for field, bit, points in terms:
+            if getattr(record, field) & bit:
+                score += points
+        scores.append(score)
+    return scores
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=50000, help="suppliers in the synthetic catalog")
+    parser.add_argument("--scopes", type=int, default=20, help="project scopes to score")
+    args = parser.parse_args()
+
+    from actions.catalog import load_catalog
+    from actions.scoring import get_scorer
+
+    with tempfile.TemporaryDirectory() as directory:
+        catalog = load_catalog(build_catalog(args.size, Path(directory)))
+        scorer = get_scorer(catalog)
+        expertise, dict_bytes = measure(catalog.as_dicts)
+        # The catalog decodes records from its mapped bitsets on access, so they are materialized to measure them
+        records, record_bytes = measure(lambda: list(catalog.records))
+
+        rng = random.Random(1)
+        scopes = [random_scope(rng) for _ in range(args.scopes)]
+        started = time.perf_counter()
+        expected = [score_dicts(expertise, scorer, scope) for scope in scopes]
+        dict_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        actual = [score_records(records, scorer, scope) for scope in scopes]
+        record_seconds = time.perf_counter() - started
+        if actual != expected:
+            raise SystemExit("Record scores differ from dict scores")
+
+    print(f"{args.size} suppliers, {args.scopes} scopes")
+    print(f"{'':>8} {'bytes/supplier':>15} {'ms/scope':>10}")
+    print(f"{'dicts':>8} {dict_bytes / args.size:>15.0f} {dict_seconds / args.scopes * 1000:>10.2f}")
+    print(f"{'records':>8} {record_bytes / args.size:>15.0f} {record_seconds / args.scopes * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import io
+import itertools
+import json
+import random
+
+import pytest
+
+from actions import batch_match
+from actions.batch_match import match_stream
+from actions.catalog import get_catalog
+from actions.matching import match_suppliers
+
+PHASES = [None, "Phase I", "phase 1", "Preclinical", "Phase II", "phase 3", "Phase IV", "unknown phase"]
+AREAS = [None, "Oncology", "cardiology", "Rare Diseases", "infectious diseases", "Neuroscience", "unknown area"]
+SERVICES = [
+    "Clinical Trial Management", "data management", "Patient Recruitment", "assay development",
+    "Bioanalytical Services", "Medical Writing", "site management", "unknown service",
+]
+POPULATIONS = [None, "adults", "Pediatric", "elderly", "seniors"]
+
+
+def generated_scopes(seed=7):
+    rng = random.Random(seed)
+    scopes = []
+    for phase, area, population in itertools.product(PHASES, AREAS, POPULATIONS):
+        services = rng.sample(SERVICES, rng.randint(0, 4))
+        if services and rng.random() < 0.2:
+            # Repeated services count twice, in both scorers
+            services.append(services[0])
+        if len(services) == 1 and rng.random() < 0.5:
+            # The form may fill a list slot with a single string
+            services = services[0]
+        scopes.append({
+            "study_phase": phase,
+            "therapeutic_area": area,
+            "services_needed": services,
+            "patient_population": population,
+        })
+    return scopes
+
+
+def run(scopes, k, chunk_size=64, check=False):
+    sink = io.StringIO()
+    processed = match_stream(io.StringIO("\n".join(map(json.dumps, scopes))), sink, k=k, check=check, chunk_size=chunk_size)
+    return processed, [json.loads(line) for line in sink.getvalue().splitlines()]
+
+
+@pytest.mark.parametrize("k", [1, 3, 5, len(get_catalog()), len(get_catalog()) + 10])
+def test_batch_matches_agree_with_match_suppliers(k):
+    scopes = generated_scopes()
+    assert any(isinstance(scope["services_needed"], str) for scope in scopes)
+
+    processed, results = run(scopes, k)
+
+    assert processed == len(scopes)
+    assert [result["id"] for result in results] == list(range(len(scopes)))
+    expected = []
+    for scope in scopes:
+        services = scope["services_needed"]
+        if isinstance(services, str):
+            services = [services]
+        expected.append(match_suppliers(scope["study_phase"], scope["therapeutic_area"], services, scope["patient_population"], limit=k))
+    assert [result["matches"] for result in results] == expected
+    assert all(len(matches) == min(k, len(get_catalog())) for matches in expected)
+
+
+def test_check_raises_when_a_result_differs_from_match_suppliers(monkeypatch):
+    monkeypatch.setattr(batch_match, "match_suppliers", lambda *args, **kwargs: [])
+
+    with pytest.raises(RuntimeError, match="differs from match_suppliers"):
+        run(generated_scopes()[:1], k=5, check=True)
+
+
+def test_string_services_score_like_a_one_item_list():
+    scope = {"study_phase": "Phase I", "therapeutic_area": "Oncology", "patient_population": "adults"}
+
+    _, as_string = run([dict(scope, services_needed="Assay Development")], k=5)
+    _, as_list = run([dict(scope, services_needed=["Assay Development"])], k=5)
+
+    assert as_string == as_list
@@ -0,0 +1,105 @@
+import struct
+
+import pytest
+
+from actions import catalog
+from actions.catalog import DEFAULT_SOURCE, FIELDS, HEADER, load_catalog, read_source, reload_catalog, write_catalog
+
+SUPPLIERS = [
+    {"name": "Acme", "specialties": ["Toxicology", "Assay Development"], "therapeutic_areas": ["Oncology"], "services": []},
+    {"name": "Bravo", "specialties": ["toxicology"], "therapeutic_areas": ["Oncology", "Neurology"], "services": ["Data management"]},
+    {"name": "Cirrus Clínica", "specialties": [], "therapeutic_areas": [], "services": ["data management", "Biostatistics"]},
+]
+
+
+@pytest.fixture
+def current(monkeypatch, tmp_path):
+    """Serve the catalog at ``tmp_path / "suppliers.bin"`` with the file watcher disabled."""
+    path = tmp_path / "suppliers.bin"
+    monkeypatch.setenv("CRO_CATALOG_PATH", str(path))
+    monkeypatch.setattr(catalog, "POLL_SECONDS", 0)
+    monkeypatch.setattr(catalog, "_current", None)
+    monkeypatch.setattr(catalog, "_stamp", None)
+    return path
+
+
+def test_binary_catalog_round_trips(tmp_path):
+    write_catalog(SUPPLIERS, tmp_path / "suppliers.bin")
+
+    loaded = load_catalog(tmp_path / "suppliers.bin")
+
+    assert list(loaded.suppliers) == ["Acme", "Bravo", "Cirrus Clínica"]
+    assert loaded.suppliers[-1] == "Cirrus Clínica"
+    assert [loaded.expertise(supplier_id) for supplier_id in range(len(loaded))] == [
+        {field: supplier[field] for field in FIELDS} for supplier in SUPPLIERS
+    ]
+    # Categories are lowercased and keep the spelling seen first
+    assert {field: {token: list(ids) for token, ids in index.items()} for field, index in loaded.index.items()} == {
+        "specialties": {"assay development": [0], "toxicology": [0, 1]},
+        "therapeutic_areas": {"neurology": [1], "oncology": [0, 1]},
+        "services": {"biostatistics": [2], "data management": [1, 2]},
+    }
+    assert loaded.registry.decode("services", loaded.records[2].services) == ["Data management", "Biostatistics"]
+    assert loaded.records[1].specialties == loaded.registry.bit("specialties", "toxicology")
+    assert loaded.version == write_catalog(SUPPLIERS, tmp_path / "again.bin").version
+
+
+def test_categories_beyond_one_byte_of_bitset(tmp_path):
+    suppliers = [
+        {"name": f"CRO {n}", "specialties": [f"Specialty {n}", f"Specialty {n + 1}"], "therapeutic_areas": [], "services": []}
+        for n in range(20)
+    ]
+    write_catalog(suppliers, tmp_path / "suppliers.bin")
+
+    loaded = load_catalog(tmp_path / "suppliers.bin")
+
+    assert [loaded.registry.decode("specialties", record.specialties) for record in loaded.records] == [
+        supplier["specialties"] for supplier in suppliers
+    ]
+    assert list(loaded.index["specialties"]["specialty 20"]) == [19]
+
+
+def test_csv_source_matches_yaml(tmp_path):
+    suppliers = read_source(DEFAULT_SOURCE)
+    lines = ["name," + ",".join(FIELDS)]
+    lines.extend(
+        ",".join([f'"{supplier["name"]}"'] + [f'"{"; ".join(supplier[field])}"' for field in FIELDS]) for supplier in suppliers
+    )
+    (tmp_path / "suppliers.csv").write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    assert read_source(tmp_path / "suppliers.csv") == suppliers
+    assert load_catalog(tmp_path / "suppliers.csv").as_dicts() == load_catalog(DEFAULT_SOURCE).as_dicts()
+
+
+def test_catalog_of_another_format_is_rejected(tmp_path):
+    path = tmp_path / "suppliers.bin"
+    path.write_bytes(HEADER.pack(b"CROCAT01", 1, 0, 0) + struct.pack("<I", 0))
+
+    with pytest.raises(ValueError, match="rebuild it"):
+        load_catalog(path)
+
+
+def test_reload_swaps_in_a_rebuilt_catalog(current):
+    write_catalog(SUPPLIERS, current)
+    first = catalog.get_catalog()
+    assert not reload_catalog()
+
+    write_catalog(SUPPLIERS[:2], current)
+
+    assert reload_catalog()
+    second = catalog.get_catalog()
+    assert second.version != first.version
+    assert list(second.suppliers) == ["Acme", "Bravo"]
+    # Requests that started before the reload keep reading the catalog they hold
+    assert list(first.suppliers) == ["Acme", "Bravo", "Cirrus Clínica"]
+
+
+def test_reload_keeps_the_current_catalog_if_the_new_file_is_unreadable(current):
+    write_catalog(SUPPLIERS, current)
+    loaded = catalog.get_catalog()
+
+    current.write_bytes(b"CROCAT01" + bytes(40))
+
+    with pytest.raises(ValueError):
+        reload_catalog()
+    assert catalog.get_catalog() is loaded
@@ -0,0 +1,34 @@
+import pytest
+
+from actions.match_cache import MatchCache, MemoryBackend, SqliteBackend
+
+
+def key(version, area="Oncology"):
+    return MatchCache.key("Phase I", area, ["Assay Development"], "Adults", 3, version)
+
+
+def test_a_new_worker_keeps_the_shared_sqlite_cache(tmp_path):
+    path = str(tmp_path / "cache.db")
+    first = MatchCache(SqliteBackend(path, 100), ttl=60)
+    assert first.lookup(key("v1"), "v1") is None
+    first.store(key("v1"), ["BioAgile"])
+
+    # Another worker process starts with no version of its own yet
+    second = MatchCache(SqliteBackend(path, 100), ttl=60)
+
+    assert second.lookup(key("v1"), "v1") == ["BioAgile"]
+    assert first.lookup(key("v1"), "v1") == ["BioAgile"]
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_a_new_version_drops_only_the_entries_of_other_versions(tmp_path, backend):
+    store = MemoryBackend(100) if backend == "memory" else SqliteBackend(str(tmp_path / "cache.db"), 100)
+    cache = MatchCache(store, ttl=60)
+    cache.lookup(key("v1"), "v1")
+    cache.store(key("v1"), ["BioAgile"])
+    # Stored by a worker that already reloaded the catalog
+    store.set(key("v2", "Cardiology"), float("inf"), ["CROquest"])
+
+    assert cache.lookup(key("v2"), "v2") is None
+    assert len(store) == 1
+    assert cache.lookup(key("v2", "Cardiology"), "v2") == ["CROquest"]
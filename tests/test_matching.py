@@ -0,0 +1,162 @@
+import asyncio
+import random
+
+import pytest
+
+from actions import matching
+from actions.catalog import DEFAULT_SOURCE, FIELDS, Catalog, compile_catalog, get_catalog, read_source
+from actions.matching import discard_partial_scores, match_suppliers, match_suppliers_async, update_partial_scores
+from actions.metrics import MATCH_CANDIDATES
+from actions.scoring import get_scorer
+
+
+SCOPE = [
+    ("study_phase", "Phase I"),
+    ("therapeutic_area", "Oncology"),
+    ("services_needed", ["Assay Development"]),
+    ("patient_population", "adults"),
+]
+
+
+@pytest.fixture
+def match_pool(monkeypatch):
+    monkeypatch.setattr(matching, "MATCH_PROCESSES", 1)
+    monkeypatch.setattr(matching, "MATCH_CACHE", None)
+    yield
+    if matching._pool is not None:
+        matching._pool.shutdown()
+    matching._pool = matching._pool_pid = None
+
+
+@pytest.fixture
+def rankings(monkeypatch):
+    """Counts the rankings done in this process."""
+    calls = []
+    top_matches = matching.top_matches
+
+    def counted(*args):
+        calls.append(args[1])
+        return top_matches(*args)
+
+    monkeypatch.setattr(matching, "top_matches", counted)
+    return calls
+
+
+def rankings_recorded():
+    # Every series holds its bucket counts followed by the sum of the observed values
+    return sum(sum(series[:-1]) for series in MATCH_CANDIDATES._series.values())
+
+
+def test_only_rankings_used_by_action_match_cros_are_recorded():
+    before = rankings_recorded()
+    try:
+        for slot, value in SCOPE:
+            update_partial_scores("test-sender", slot, value)
+        assert rankings_recorded() == before
+
+        match_suppliers("Phase I", "Oncology", ["Assay Development"], "adults", sender_id="test-sender")
+        assert rankings_recorded() == before + 1
+    finally:
+        discard_partial_scores("test-sender")
+
+
+def test_rankings_done_in_the_match_pool_are_recorded(match_pool):
+    before = rankings_recorded()
+
+    matches = asyncio.run(match_suppliers_async("Phase I", "Oncology", ["Assay Development"], "adults"))
+
+    assert rankings_recorded() == before + 1
+    assert matches == match_suppliers("Phase I", "Oncology", ["Assay Development"], "adults")
+
+
+def test_validation_ranks_once_the_scope_is_complete_and_only_when_scores_change(rankings):
+    try:
+        for slot, value in SCOPE[:-1]:
+            update_partial_scores("test-sender", slot, value)
+        assert rankings == []
+
+        update_partial_scores("test-sender", *SCOPE[-1])
+        assert len(rankings) == 1
+
+        # No rule rewards either population, and a different spelling scores the same
+        update_partial_scores("test-sender", "patient_population", "elderly")
+        update_partial_scores("test-sender", "therapeutic_area", "oncology")
+        assert len(rankings) == 1
+
+        update_partial_scores("test-sender", "therapeutic_area", "Cardiology")
+        assert len(rankings) == 2
+
+        match_suppliers("Phase I", "Cardiology", ["Assay Development"], "elderly", sender_id="test-sender")
+        assert len(rankings) == 2
+    finally:
+        discard_partial_scores("test-sender")
+
+
+def test_validation_ranks_in_the_match_pool(match_pool, monkeypatch):
+    def rank_on_the_loop(self, limit, scorer):
+        raise AssertionError("ranked on the event loop")
+
+    async def fill_form_and_match():
+        for slot, value in SCOPE:
+            update_partial_scores("test-sender", slot, value)
+        assert matching._partial_scores["test-sender"].pending(matching.TOP_MATCHES) is not None
+        return await match_suppliers_async(*(value for _, value in SCOPE), sender_id="test-sender")
+
+    monkeypatch.setattr(matching.PartialScores, "top", rank_on_the_loop)
+    try:
+        matches = asyncio.run(fill_form_and_match())
+    finally:
+        discard_partial_scores("test-sender")
+
+    # Without a sender id the scope is ranked in full, not from partial scores
+    assert matches == match_suppliers(*(value for _, value in SCOPE))
+
+
+SERVICES = ["Clinical Trial Management", "data management", "Patient Recruitment", "assay development", "Medical Writing", "unknown service"]
+VALUES = {
+    "study_phase": [None, "Phase I", "phase 2", "Preclinical", "Phase IV", "unknown phase"],
+    "therapeutic_area": [None, "oncology", "Cardiology", "Rare Diseases", "dermatology"],
+    "patient_population": [None, "adults", "Pediatric", "elderly", "seniors"],
+}
+
+
+def synthetic_catalog(size, seed):
+    """A catalog of ``size`` suppliers with random categories, including the ones only phase and population rules require."""
+    rng = random.Random(seed)
+    source = read_source(DEFAULT_SOURCE)
+    vocabulary = {field: sorted({value for supplier in source for value in supplier[field]}) for field in FIELDS}
+    vocabulary["specialties"] += ["Preclinical", "Clinical Trials", "Pediatric", "Geriatric"]
+    suppliers = [
+        dict(name=f"Supplier {n}", **{field: rng.sample(values, rng.randint(0, min(4, len(values)))) for field, values in vocabulary.items()})
+        for n in range(size)
+    ]
+    return Catalog(compile_catalog(suppliers))
+
+
+@pytest.mark.parametrize("catalog", [get_catalog(), synthetic_catalog(400, seed=3)], ids=["default", "synthetic"])
+def test_partial_rankings_equal_a_full_recompute(catalog, monkeypatch):
+    monkeypatch.setattr(matching, "MATCH_CACHE", None)
+    monkeypatch.setattr(matching, "get_scorer", lambda catalog_=None: get_scorer(catalog_ or catalog))
+    rng = random.Random(11)
+    for conversation in range(200):
+        sender_id = f"test-sender-{conversation}"
+        slots = dict.fromkeys(matching.DIMENSIONS)
+        try:
+            for _ in range(rng.randint(1, 10)):
+                slot = rng.choice(matching.DIMENSIONS)
+                if slot == "services_needed":
+                    value = rng.sample(SERVICES, rng.randint(0, 3))
+                    if value and rng.random() < 0.3:
+                        value.append(value[0])
+                else:
+                    value = rng.choice(VALUES[slot])
+                slots[slot] = value
+                # Some slots change after validation, without update_partial_scores
+                if rng.random() < 0.85:
+                    update_partial_scores(sender_id, slot, value)
+            scope = [slots[slot] for slot in ("study_phase", "therapeutic_area", "services_needed", "patient_population")]
+            for limit in (matching.TOP_MATCHES, 1, 12):
+                expected = match_suppliers(*scope, limit=limit, catalog=catalog)
+                assert match_suppliers(*scope, limit=limit, catalog=catalog, sender_id=sender_id) == expected, scope
+        finally:
+            discard_partial_scores(sender_id)
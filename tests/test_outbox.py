@@ -0,0 +1,161 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from actions import outbox
+from actions.outbox import DELIVERED, FAILED, MAX_ATTEMPTS, PENDING, SENDING, DeliveryWorker, Outbox
+
+
+def item(store, key):
+    return store._db.execute(
+        "SELECT status, attempts, next_attempt_at, last_error FROM outbox WHERE idempotency_key = ?", (key,)
+    ).fetchone()
+
+
+def deliver(store, statuses, batches):
+    """Run ``batches`` delivery rounds against a stub endpoint answering with ``statuses``, then 200.
+
+    Returns the requests the stub received, as ``(Idempotency-Key, body)``.
+    """
+    received = []
+
+    async def handle(request):
+        received.append((request.headers.get("Idempotency-Key"), await request.json()))
+        return web.Response(status=statuses[len(received) - 1] if len(received) <= len(statuses) else 200)
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/projects", handle)
+        async with TestServer(app, host="127.0.0.1") as server:
+            worker = DeliveryWorker(store, str(server.make_url("/projects")))
+            async with aiohttp.ClientSession() as session:
+                for _ in range(batches):
+                    await worker.deliver_batch(session)
+
+    asyncio.run(run())
+    return received
+
+
+@pytest.fixture
+def store(tmp_path):
+    return Outbox(str(tmp_path / "outbox.db"))
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    # Retries are due at once, so every round sends the item again
+    monkeypatch.setattr(outbox, "BACKOFF_BASE_SECONDS", 0.0)
+
+
+def test_delivers_with_the_idempotency_key(store):
+    store.enqueue({"cro_name": "Acme"}, "key-1")
+
+    received = deliver(store, [], batches=1)
+
+    assert received == [("key-1", {"cro_name": "Acme"})]
+    assert item(store, "key-1")[:2] == (DELIVERED, 0)
+    assert store.delivered == 1
+
+
+def test_retries_server_errors_until_delivered(store, no_backoff):
+    store.enqueue({"cro_name": "Acme"}, "key-1")
+
+    received = deliver(store, [503, 500], batches=3)
+
+    assert [key for key, _ in received] == ["key-1"] * 3
+    status, attempts, _, last_error = item(store, "key-1")
+    assert (status, attempts) == (DELIVERED, 2)
+    assert last_error == "HTTP 500"
+
+
+def test_backs_off_exponentially_up_to_the_maximum(store, monkeypatch):
+    monkeypatch.setattr(outbox.random, "uniform", lambda low, high: high)
+    store.enqueue({"cro_name": "Acme"}, "key-1")
+    item_id = store._db.execute("SELECT id FROM outbox").fetchone()[0]
+
+    delays = []
+    for attempts in range(1, MAX_ATTEMPTS):
+        before = time.time()
+        store.mark_failed(item_id, attempts, "HTTP 503")
+        status, _, next_attempt_at, _ = item(store, "key-1")
+        assert status == PENDING
+        delays.append(next_attempt_at - before)
+
+    expected = [min(outbox.BACKOFF_BASE_SECONDS * 2 ** n, outbox.BACKOFF_MAX_SECONDS) for n in range(MAX_ATTEMPTS - 1)]
+    assert delays == pytest.approx(expected, abs=0.5)
+
+
+def test_waits_for_the_backoff_before_retrying(store):
+    store.enqueue({"cro_name": "Acme"}, "key-1")
+
+    received = deliver(store, [503], batches=2)
+
+    assert len(received) == 1
+    status, attempts, next_attempt_at, _ = item(store, "key-1")
+    assert (status, attempts) == (PENDING, 1)
+    assert next_attempt_at > time.time()
+
+
+def test_gives_up_after_max_attempts(store, no_backoff):
+    store.enqueue({"cro_name": "Acme"}, "key-1")
+
+    received = deliver(store, [500] * (MAX_ATTEMPTS + 1), batches=MAX_ATTEMPTS + 2)
+
+    assert len(received) == MAX_ATTEMPTS
+    status, attempts, next_attempt_at, last_error = item(store, "key-1")
+    assert (status, attempts, next_attempt_at) == (FAILED, MAX_ATTEMPTS, None)
+    assert last_error == "HTTP 500"
+    assert store.failed == 1
+
+
+def test_unreachable_endpoint_counts_as_a_failed_attempt(store):
+    store.enqueue({"cro_name": "Acme"}, "key-1")
+
+    async def run():
+        worker = DeliveryWorker(store, "http://127.0.0.1:9/projects")
+        async with aiohttp.ClientSession() as session:
+            await worker.deliver_batch(session)
+
+    asyncio.run(run())
+
+    status, attempts, _, last_error = item(store, "key-1")
+    assert (status, attempts) == (PENDING, 1)
+    assert "ClientConnectorError" in last_error
+
+
+def test_claimed_items_are_not_handed_to_another_process(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    first, second = Outbox(path), Outbox(path)
+    for n in range(3):
+        first.enqueue({"n": n}, f"key-{n}")
+
+    claimed = first.due(2)
+
+    assert [key for _, key, *_ in claimed] == ["key-0", "key-1"]
+    assert [key for _, key, *_ in second.due(10)] == ["key-2"]
+    assert second.due(10) == []
+    assert first.depth() == 3
+
+
+def test_items_of_an_expired_lease_are_due_again(store, monkeypatch):
+    # The claiming process died before it could mark the item, and the lease runs out at once
+    monkeypatch.setattr(outbox, "LEASE_SECONDS", 0.0)
+    store.enqueue({"cro_name": "Acme"}, "key-1")
+    assert len(store.due(10)) == 1
+    assert item(store, "key-1")[0] == SENDING
+
+    assert [key for _, key, *_ in store.due(10)] == ["key-1"]
+
+
+def test_warns_at_startup_without_a_delivery_url(monkeypatch, caplog):
+    monkeypatch.delenv("CRO_DELIVERY_URL", raising=False)
+    monkeypatch.setattr(outbox, "_worker", None)
+
+    asyncio.run(outbox._start_delivery_listener(None, None))
+
+    assert "CRO_DELIVERY_URL is not set" in caplog.text
+    assert outbox._worker is None
@@ -0,0 +1,49 @@
+import pytest
+
+from addons.replay import action_calls
+
+ACTIONS = {"action_match_cros", "validate_project_scope_form"}
+
+EVENTS = [
+    {"event": "session_started"},
+    {"event": "slot", "name": "requested_slot", "value": "therapeutic_area"},
+    {"event": "action", "name": "action_listen"},
+    {"event": "user", "text": "oncology", "parse_data": {"intent": {"name": "provide_therapeutic_area"}}},
+    {"event": "action", "name": "action_extract_slots"},
+    {"event": "slot", "name": "therapeutic_area", "value": "Oncologyy"},
+    {"event": "action", "name": "project_scope_form"},
+    {"event": "slot", "name": "therapeutic_area", "value": "Oncology"},
+    {"event": "slot", "name": "requested_slot", "value": "services_needed"},
+    {"event": "action", "name": "action_listen"},
+    {"event": "user", "text": "nothing", "parse_data": {}},
+    {"event": "action", "name": "action_extract_slots"},
+    {"event": "action", "name": "project_scope_form"},
+    {"event": "action", "name": "action_match_cros"},
+]
+
+
+def test_form_validation_gets_the_extracted_values_as_trailing_slot_events():
+    calls = list(action_calls("s1", EVENTS, ACTIONS, {}))
+
+    assert [(position, name) for position, name, _ in calls] == [
+        (6, "validate_project_scope_form"),
+        (12, "validate_project_scope_form"),
+        (13, "action_match_cros"),
+    ]
+    tracker = calls[0][2]["tracker"]
+    assert tracker["events"] == EVENTS[:6] + [{"event": "slot", "name": "therapeutic_area", "value": "Oncologyy"}]
+    assert tracker["slots"] == {"requested_slot": "therapeutic_area", "therapeutic_area": "Oncologyy"}
+    assert tracker["latest_message"]["text"] == "oncology"
+    # Nothing was extracted from the second message, so there is nothing to validate
+    assert calls[1][2]["tracker"]["events"] == EVENTS[:12]
+    tracker = calls[2][2]["tracker"]
+    assert tracker["events"] == EVENTS[:13]
+    assert tracker["slots"] == {"requested_slot": "services_needed", "therapeutic_area": "Oncology"}
+
+
+def test_validation_payload_has_the_slots_rasa_sdk_validates():
+    Tracker = pytest.importorskip("rasa_sdk").Tracker
+
+    _, _, payload = next(action_calls("s1", EVENTS, ACTIONS, {}))
+
+    assert Tracker.from_dict(payload["tracker"]).slots_to_validate() == {"therapeutic_area": "Oncologyy"}
@@ -0,0 +1,80 @@
+import itertools
+
+import pytest
+
+from actions.reports import Scope, render
+
+VALUES = {
+    "study_phase": [None, "", "Phase II"],
+    "therapeutic_area": [None, "Oncology"],
+    "services_needed": [None, [], ["Data Management", "Biostatistics"], "Toxicology"],
+    "patient_population": [None, "Adults"],
+    "timeline": [None, "6 months"],
+    "cro_name": [None, "Icon"],
+}
+
+SLOTS = [dict(zip(VALUES, combination)) for combination in itertools.product(*VALUES.values())]
+
+
+# The messages as action_output_project_scope and action_send_project built them with f-strings
+def baseline_scope(study_phase, therapeutic_area, services_needed, patient_population, timeline, cro_name):
+    msg = "Project Scope:\n"
+    if study_phase:
+        msg += f"• Study Phase: {study_phase}\n"
+    if therapeutic_area:
+        msg += f"• Therapeutic Area: {therapeutic_area}\n"
+    if services_needed:
+        msg += f"• Services Needed: {', '.join(services_needed)}\n"
+    if patient_population:
+        msg += f"• Patient Population: {patient_population}\n"
+    if timeline:
+        msg += f"• Timeline: {timeline}\n"
+    if msg.strip() == "Project Scope:":
+        msg = "Project information is not available."
+    return msg
+
+
+def baseline_report(study_phase, therapeutic_area, services_needed, patient_population, timeline, cro_name):
+    report = "Project Report:\n"
+    summary_lines = []
+    if study_phase and therapeutic_area:
+        summary_lines.append(f"This project is designed as a {study_phase} clinical study in the therapeutic area of {therapeutic_area}.")
+    elif study_phase:
+        summary_lines.append(f"This project is designed as a {study_phase} clinical study.")
+    elif therapeutic_area:
+        summary_lines.append(f"This project focuses on the therapeutic area of {therapeutic_area}.")
+    if patient_population:
+        summary_lines.append(f"The target patient population consists of {patient_population}.")
+    if services_needed:
+        summary_lines.append(f"Key services required for this project include: {', '.join(services_needed)}.")
+    if timeline:
+        summary_lines.append(f"The anticipated project duration is {timeline}.")
+    if summary_lines:
+        report += "\n".join(summary_lines)
+    else:
+        report += "Project details are incomplete."
+    return report
+
+
+def baseline_handoff(study_phase, therapeutic_area, services_needed, patient_population, timeline, cro_name):
+    return (
+        f"Perfect! Your project details have been sent to {cro_name}!\n\n"
+        f"Project Summary:\n"
+        f"• Study Phase: {study_phase}\n"
+        f"• Therapeutic Area: {therapeutic_area}\n"
+        f"• Services Needed: {', '.join(services_needed) if services_needed else 'Not specified'}\n"
+        f"• Patient Population: {patient_population}\n"
+        f"• Timeline: {timeline}\n\n"
+        f"{cro_name} will contact you within 24-48 hours to discuss your project in detail."
+    )
+
+
+@pytest.mark.parametrize("format, baseline", [
+    ("scope", baseline_scope),
+    ("report", baseline_report),
+    ("handoff", baseline_handoff),
+])
+def test_chat_messages_match_the_f_string_output(format, baseline):
+    for slots in SLOTS:
+        assert render(Scope.from_slots(slots), format) == baseline(**slots), slots
+
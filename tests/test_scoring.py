@@ -0,0 +1,40 @@
+import logging
+
+from actions.catalog import get_catalog
+from actions.matching import match_suppliers, render_matches
+from actions.scoring import get_scorer
+
+SCOPE = {
+    "study_phase": "Phase I",
+    "therapeutic_area": "Oncology",
+    "services_needed": ["Assay Development", "Data Management"],
+    "patient_population": "adults",
+}
+
+
+def test_ranked_scores_add_up_from_the_rule_breakdown(caplog):
+    catalog = get_catalog()
+    scorer = get_scorer(catalog)
+    terms = scorer.terms(SCOPE)
+
+    with caplog.at_level(logging.ERROR, logger="actions.matching"):
+        matches = match_suppliers(*(SCOPE[slot] for slot in SCOPE), limit=len(catalog), catalog=catalog)
+
+    assert not caplog.records
+    for match in matches:
+        hits = scorer.explain(catalog.suppliers.index(match["name"]), terms)
+        assert match["score"] == scorer.total(hits)
+        assert match["score"] == min(scorer.base_score + sum(rule["points"] for rule in match["rules"]), scorer.max_score)
+
+
+def test_a_ranked_score_the_breakdown_does_not_explain_is_logged(caplog):
+    scorer = get_scorer(get_catalog())
+    terms = scorer.terms(SCOPE)
+    supplier_id = terms[0].supplier_ids[0]
+    explained = scorer.total(scorer.explain(supplier_id, terms))
+
+    with caplog.at_level(logging.ERROR, logger="actions.matching"):
+        [match] = render_matches([[supplier_id, explained - 1]], SCOPE, scorer)
+
+    assert match["score"] == explained
+    assert "differs from its ranked score" in caplog.text
@@ -0,0 +1,15 @@
+from actions.sqlite_db import ProcessConnection
+
+
+def test_opens_one_connection_per_process(tmp_path):
+    connection = ProcessConnection(str(tmp_path / "test.db"), ["CREATE TABLE IF NOT EXISTS items (id INTEGER)"])
+
+    first = connection.get()
+    assert connection.get() is first
+    assert first.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+    # As seen by a forked child, whose pid differs from the one that opened the connection
+    connection._pid = -1
+    second = connection.get()
+    assert second is not first
+    assert second.execute("SELECT COUNT(*) FROM items").fetchone() == (0,)
@@ -0,0 +1,120 @@
+import logging
+from types import MappingProxyType
+
+import pytest
+
+from actions import vocabulary
+from actions.vocabulary import VALIDATION, build_registry, edit_distance, load_registry, max_edits, resolve, write_snapshot
+
+
+@pytest.mark.parametrize("slot, value, expected", [
+    ("study_phase", "ph 2", "Phase II"),
+    ("study_phase", "first in human", "Phase I"),
+    ("therapeutic_area", "oncolgy", "Oncology"),
+    ("therapeutic_area", "Cardiolgy", "Cardiology"),
+    ("therapeutic_area", "imunology", "Immunology"),
+    ("therapeutic_area", "cancer", "Oncology"),
+    ("services_needed", "Data Mgmt", "Data Management"),
+    ("services_needed", "clinical trial managment", "Clinical Trial Management"),
+    ("services_needed", "regulatroy support", "Regulatory Support"),
+    ("patient_population", "pediatirc", "Pediatric"),
+    ("patient_population", "kids", "Pediatric"),
+])
+def test_resolves_synonyms_and_misspellings(slot, value, expected):
+    assert resolve(slot, value) == expected
+
+
+@pytest.mark.parametrize("slot, value", [
+    # Real, different words that are only a few letters away from a choice
+    ("therapeutic_area", "hematology"),
+    ("therapeutic_area", "nephrology"),
+    ("therapeutic_area", "urology"),
+    ("therapeutic_area", "ology"),
+    # Fragments of several services
+    ("services_needed", "data"),
+    ("services_needed", "site"),
+    ("services_needed", "patient"),
+    ("services_needed", "clinical"),
+    # Phases differ by one character, so they never match fuzzily
+    ("study_phase", "phase v"),
+    ("therapeutic_area", "virology"),
+])
+def test_rejects_values_that_are_not_a_close_misspelling(slot, value):
+    assert resolve(slot, value) is None
+
+
+def test_edit_distance_counts_transpositions_once():
+    assert edit_distance("oncology", "oncolgoy", 2) == 1
+    assert edit_distance("kitten", "sitting", 5) == 3
+    assert edit_distance("kitten", "sitting", 1) == 2
+
+
+def test_short_terms_only_match_exactly():
+    assert max_edits("onc") == 0
+    assert max_edits("oncology") == 1
+    assert max_edits("clinical trial management") == 2
+
+
+def tables(registry):
+    """The registry's contents in a comparable form, with each trigram index as its terms."""
+    slots = {
+        slot: table._replace(fuzzy=table.fuzzy and dict(zip(table.fuzzy.terms, table.fuzzy.canonical)))
+        for slot, table in registry.slots.items()
+    }
+    return slots, registry.timeline
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    return tmp_path / "vocabulary.snapshot"
+
+
+@pytest.fixture
+def built(monkeypatch):
+    """Count the validation tables built from YAML instead of loaded from the snapshot."""
+    calls = []
+
+    def build(*args):
+        calls.append(args)
+        return build_registry(*args)
+
+    monkeypatch.setattr(vocabulary, "build_registry", build)
+    return calls
+
+
+def test_tables_are_loaded_from_a_current_snapshot(snapshot, built):
+    write_snapshot(snapshot)
+    built.clear()
+
+    registry = load_registry(snapshot)
+
+    assert built == []
+    assert tables(registry) == tables(VALIDATION)
+    assert isinstance(registry.slots, MappingProxyType)
+
+
+def test_tables_are_built_without_a_snapshot(snapshot, built, caplog):
+    assert tables(load_registry(snapshot)) == tables(VALIDATION)
+    assert len(built) == 1
+    assert not caplog.records
+
+
+def test_a_snapshot_of_other_sources_is_rebuilt(snapshot, built, monkeypatch, caplog):
+    write_snapshot(snapshot)
+    built.clear()
+    monkeypatch.setattr(vocabulary, "_sources_version", lambda *paths: "older")
+
+    with caplog.at_level(logging.INFO, logger="actions.vocabulary"):
+        assert tables(load_registry(snapshot)) == tables(VALIDATION)
+
+    assert len(built) == 1
+    assert "out of date" in caplog.text
+
+
+def test_an_unreadable_snapshot_is_rebuilt(snapshot, built, caplog):
+    snapshot.write_bytes(b"not a pickle")
+
+    assert tables(load_registry(snapshot)) == tables(VALIDATION)
+
+    assert len(built) == 1
+    assert "Could not read" in caplog.text